@@ -1,6 +1,6 @@
 """Database configuration and setup for Vocalis"""
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, DeclarativeBase, Session
 from typing import Generator
 import os
@@ -16,6 +16,18 @@ DEMO_DATABASE_URL = os.getenv(
 )
 DEMO_ACCOUNT_EMAIL = "doctor@hopital-demo.fr"
 
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Enable WAL journaling on each new SQLite connection
+
+    WAL lets readers proceed while a write is in progress, and synchronous=NORMAL
+    skips the fsync on every commit (still safe against corruption in WAL mode).
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
 # Create engines
 def _create_engine(database_url):
     """Create SQLAlchemy engine with appropriate settings"""
@@ -29,7 +41,13 @@ def _create_engine(database_url):
     else:
         kwargs["pool_pre_ping"] = True  # Verify connections before using
 
-    return create_engine(database_url, **kwargs)
+    engine = create_engine(database_url, **kwargs)
+
+    # Pooled connections are reused across requests; configure them once on connect
+    if database_url.startswith("sqlite"):
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+
+    return engine
 
 prod_engine = _create_engine(PRODUCTION_DATABASE_URL)
 demo_engine = _create_engine(DEMO_DATABASE_URL)
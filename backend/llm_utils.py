@@ -1,16 +1,56 @@
 """LLM utilities for prescription extraction and chat"""
 
+import asyncio
 import base64
+import hashlib
 import httpx
+import orjson
 import logging
-import tempfile
 import os
-from typing import Optional, List
-from pydantic import BaseModel
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from operator import attrgetter
+from typing import AsyncIterator, Dict, Optional, List, Tuple
+from pydantic import BaseModel, Field
 from datetime import datetime
 
 logger = logging.getLogger("vocalis-backend")
 
+# ============================================================================
+# OLLAMA CONFIGURATION
+# ============================================================================
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "mistral")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_USE_MLOCK = os.getenv("OLLAMA_USE_MLOCK", "true").lower() == "true"
+OLLAMA_NUM_THREAD = os.getenv("OLLAMA_NUM_THREAD")
+# Layers offloaded to the GPU (unset = Ollama offloads as many as fit, 0 = CPU only)
+OLLAMA_NUM_GPU = os.getenv("OLLAMA_NUM_GPU")
+
+# Context window (KV cache size). It must hold system prompt + prompt + reply;
+# a larger window only costs memory.
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+OLLAMA_NUM_BATCH = int(os.getenv("OLLAMA_NUM_BATCH", "512"))
+
+# Longest chat message accepted, in (estimated) tokens
+MAX_MESSAGE_TOKENS = 1024
+
+# Decode budgets: the reply is a short confirmation plus a question, the fused
+# call also carries the extracted fields as JSON
+REPLY_MAX_TOKENS = 192
+FUSED_MAX_TOKENS = 384
+
+# Tokens reserved for the chat template Ollama wraps around system + prompt
+_TEMPLATE_TOKENS = 16
+
+# Greedy decoding for extraction calls: deterministic output, no sampling work
+GREEDY_SAMPLING = {"temperature": 0.0, "top_k": 1, "top_p": 1.0, "repeat_penalty": 1.0}
+
 # ============================================================================
 # PROMPTS
 # ============================================================================
@@ -29,6 +69,49 @@ SYSTEM_PROMPT = (
     "Sois clair, concis et professionnel. Reponds EN FRANCAIS uniquement."
 )
 
+# Static prompt parts, built once instead of on every call. The system prompt
+# itself is sent as Ollama's "system" field and tokenized server-side.
+# Instructions come before the per-request data in each prompt so the prefix
+# Ollama can reuse from its KV cache extends past the system prompt.
+EXTRACTION_OUTPUT_FORMAT = (
+    "Tu extrais les informations medicales du nouveau message.\n"
+    "REPONSE (9 lignes SEULEMENT, format exact):\n"
+    "Nom:\nAge:\nDiagnostic:\nMedicament:\nDosage:\nDuree:\nInstructions:\nAllergies:\nConditions:"
+)
+# The 9 lines contain no blank line: anything after one is commentary
+EXTRACTION_STOP = ["\n\n"]
+
+RESPONSE_INSTRUCTIONS = "Reponds en francais. Confirme les infos recues et demande les infos manquantes."
+
+# Fixed reply once every field is known: nothing left to ask, no generation needed
+COMPLETE_RESPONSE = "Informations complètes. Vous pouvez générer l'ordonnance."
+
+FUSED_OUTPUT_FORMAT = (
+    "1. Extrais les nouvelles informations du message (laisse vide si absent).\n"
+    "2. Reponds en francais: confirme les infos recues et demande les infos manquantes.\n\n"
+    "REPONSE (JSON SEULEMENT, format exact):\n"
+    '{"extracted": {"Nom": "", "Age": "", "Diagnostic": "", "Medicament": "", '
+    '"Dosage": "", "Duree": "", "Instructions": "", "Allergies": "", "Conditions": ""}, '
+    '"reply": ""}'
+)
+
+# JSON Schema enforced by Ollama on the fused output (same keys as above)
+_FUSED_EXTRACTED_KEYS = (
+    "Nom", "Age", "Diagnostic", "Medicament", "Dosage", "Duree", "Instructions", "Allergies", "Conditions",
+)
+FUSED_OUTPUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "extracted": {
+            "type": "object",
+            "properties": {key: {"type": "string"} for key in _FUSED_EXTRACTED_KEYS},
+            "required": list(_FUSED_EXTRACTED_KEYS),
+        },
+        "reply": {"type": "string"},
+    },
+    "required": ["extracted", "reply"],
+}
+
 # ============================================================================
 # SECURITY HELPERS
 # ============================================================================
@@ -43,48 +126,89 @@ def sanitize_input(text: str, max_length: int = 5000) -> str:
     return text.strip()
 
 
+def estimate_tokens(text: str) -> int:
+    """Cheap approximate token count, no tokenizer round-trip.
+
+    Uses ~3 bytes per token rather than the usual ~4: French text and JSON
+    tokenize denser than English, and the budgets built on this estimate
+    must not come out short.
+    """
+    return (len(text.encode("utf-8")) + 2) // 3
+
+
+# Computed once: every call sends this system prompt
+SYSTEM_PROMPT_TOKENS = estimate_tokens(SYSTEM_PROMPT)
+
+# Largest chat turn: instructions + collected data (~256), longest accepted
+# message and the fused reply. Warn now rather than have Ollama silently
+# shift the context.
+_MAX_TURN_TOKENS = SYSTEM_PROMPT_TOKENS + _TEMPLATE_TOKENS + 256 + MAX_MESSAGE_TOKENS + FUSED_MAX_TOKENS
+if _MAX_TURN_TOKENS > OLLAMA_NUM_CTX:
+    logger.warning(
+        f"OLLAMA_NUM_CTX={OLLAMA_NUM_CTX} is below the largest chat turn (~{_MAX_TURN_TOKENS} tokens); raise it"
+    )
+
+
+# Largest decoded signature image accepted
+MAX_SIGNATURE_BYTES = 1_000_000
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
 def validate_signature_image(signature_base64: str) -> Optional[bytes]:
     """Validate and decode base64 signature image"""
     if not signature_base64:
         return None
 
     try:
-        if "," in signature_base64:
-            sig_data = signature_base64.split(",")[1]
-        else:
-            sig_data = signature_base64
-
-        img_bytes = base64.b64decode(sig_data, validate=True)
+        # Drop a "data:image/png;base64," prefix if present
+        sig_data = signature_base64.rpartition(",")[2]
 
-        if len(img_bytes) > 1_000_000:
-            logger.warning(f"Signature image too large: {len(img_bytes)} bytes")
+        # Reject oversized payloads before decoding them
+        if len(sig_data) * 3 // 4 > MAX_SIGNATURE_BYTES:
+            logger.warning(f"Signature image too large: ~{len(sig_data) * 3 // 4} bytes")
             return None
 
-        if not img_bytes.startswith(b'\x89PNG\r\n\x1a\n'):
+        # Check the PNG signature on the first 12 characters (9 bytes) so
+        # other images are rejected without decoding the whole payload
+        if not base64.b64decode(sig_data[:12], validate=True).startswith(_PNG_SIGNATURE):
             logger.warning("Signature image is not a valid PNG")
             return None
 
-        return img_bytes
+        return base64.b64decode(sig_data, validate=True)
 
     except (ValueError, TypeError) as e:
         logger.warning(f"Invalid base64 signature: {e}")
         return None
 
 
-def cleanup_temp_file(filepath: str):
-    """Cleanup temporary PDF file"""
-    try:
-        if os.path.exists(filepath):
-            os.remove(filepath)
-            logger.info(f"Cleaned up temp file: {filepath}")
-    except Exception as e:
-        logger.error(f"Failed to cleanup temp file {filepath}: {e}")
-
-
 # ============================================================================
 # DATA MODELS
 # ============================================================================
 
+# Required prescription fields and their display labels, in prompt order
+_REQUIRED_FIELDS = (
+    ('patientName', 'Nom du patient'),
+    ('patientAge', 'Age/Date de naissance'),
+    ('diagnosis', 'Diagnostic'),
+    ('medication', 'Medicament'),
+    ('dosage', 'Posologie'),
+    ('duration', 'Duree du traitement'),
+    ('specialInstructions', 'Instructions speciales'),
+)
+# Short labels used when echoing collected fields back into prompts
+_DISPLAY_FIELDS = (
+    ('patientName', 'Nom'),
+    ('patientAge', 'Age'),
+    ('diagnosis', 'Diagnostic'),
+    ('medication', 'Medicament'),
+    ('dosage', 'Posologie'),
+    ('duration', 'Duree'),
+    ('specialInstructions', 'Instructions'),
+)
+# Reads every required field in one C call (is_complete runs on each chat turn)
+_get_required_values = attrgetter(*(field for field, _ in _REQUIRED_FIELDS))
+
+
 class PrescriptionData(BaseModel):
     """Prescription information"""
     patientName: Optional[str] = None
@@ -99,48 +223,28 @@ class PrescriptionData(BaseModel):
 
     def get_missing_fields(self) -> List[str]:
         """Get list of missing required fields"""
-        required = [
-            ('patientName', 'Nom du patient'),
-            ('patientAge', 'Age/Date de naissance'),
-            ('diagnosis', 'Diagnostic'),
-            ('medication', 'Medicament'),
-            ('dosage', 'Posologie'),
-            ('duration', 'Duree du traitement'),
-            ('specialInstructions', 'Instructions speciales'),
-        ]
-        missing = []
-        for field, label in required:
-            if not getattr(self, field):
-                missing.append(label)
-        return missing
+        return [label for field, label in _REQUIRED_FIELDS if not getattr(self, field)]
 
     def is_complete(self) -> bool:
         """Check if all required fields are present"""
-        return len(self.get_missing_fields()) == 0
+        return all(_get_required_values(self))
 
     def format_display(self) -> str:
         """Format for display"""
-        lines = []
-        if self.patientName:
-            lines.append(f"- Nom: {self.patientName}")
-        if self.patientAge:
-            lines.append(f"- Age: {self.patientAge}")
-        if self.diagnosis:
-            lines.append(f"- Diagnostic: {self.diagnosis}")
-        if self.medication:
-            lines.append(f"- Medicament: {self.medication}")
-        if self.dosage:
-            lines.append(f"- Posologie: {self.dosage}")
-        if self.duration:
-            lines.append(f"- Duree: {self.duration}")
-        if self.specialInstructions:
-            lines.append(f"- Instructions: {self.specialInstructions}")
-        return "\n".join(lines) if lines else "Aucune info"
+        return "\n".join(
+            f"- {label}: {getattr(self, field)}"
+            for field, label in _DISPLAY_FIELDS if getattr(self, field)
+        ) or "Aucune info"
+
+
+# Chat session used when the client does not send a session_id
+DEFAULT_SESSION_ID = "chat_session"
 
 
 class ChatRequest(BaseModel):
     """User message"""
     message: str
+    session_id: str = Field(DEFAULT_SESSION_ID, min_length=1, max_length=64)
 
 
 class ChatResponse(BaseModel):
@@ -149,49 +253,293 @@ class ChatResponse(BaseModel):
     is_complete: bool
     missing_fields: List[str]
     prescription_data: PrescriptionData
+    session_id: str = DEFAULT_SESSION_ID
 
 
 class GeneratePDFRequest(BaseModel):
     """Request to generate PDF"""
     signature_base64: str
+    session_id: str = Field(DEFAULT_SESSION_ID, min_length=1, max_length=64)
 
 
 # ============================================================================
 # LLM FUNCTIONS
 # ============================================================================
 
-async def call_ollama(prompt: str, max_tokens: int = 100) -> str:
-    """Call Ollama API asynchronously"""
-    import os
-    OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-    OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "mistral")
+# Pooled keep-alive connections to Ollama, shared by every call instead of
+# opening a new socket per request. Closed by close_ollama_client() on shutdown.
+_OLLAMA_CLIENT: Optional[httpx.AsyncClient] = None
+
+# Generations sent to Ollama at once; match OLLAMA_NUM_PARALLEL on the server.
+# Extra requests wait here, where the 30s client timeout is not yet running,
+# instead of in Ollama's queue.
+OLLAMA_MAX_CONCURRENT = int(os.getenv("OLLAMA_MAX_CONCURRENT", "4"))
+_OLLAMA_SLOTS = asyncio.BoundedSemaphore(OLLAMA_MAX_CONCURRENT)
+_ollama_load = {"running": 0, "waiting": 0}
+
 
+@asynccontextmanager
+async def _ollama_slot() -> AsyncIterator[None]:
+    """Hold one of the OLLAMA_MAX_CONCURRENT generation slots"""
+    _ollama_load["waiting"] += 1
     try:
-        url = f"{OLLAMA_BASE_URL}/api/generate"
-        payload = {
-            "model": OLLAMA_MODEL,
-            "prompt": prompt,
-            "stream": False,
-            "temperature": 0.1,
-            "top_p": 0.9,
-        }
-        async with httpx.AsyncClient(timeout=30) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            return data.get("response", "").strip()
+        await _OLLAMA_SLOTS.acquire()
+    finally:
+        _ollama_load["waiting"] -= 1
+    _ollama_load["running"] += 1
+    try:
+        yield
+    finally:
+        _ollama_load["running"] -= 1
+        _OLLAMA_SLOTS.release()
+
+
+def get_ollama_load() -> Dict[str, int]:
+    """Generations currently running in Ollama and waiting for a slot"""
+    return dict(_ollama_load)
+
+
+def get_ollama_client() -> httpx.AsyncClient:
+    """Return the shared async Ollama client, creating it on first use"""
+    global _OLLAMA_CLIENT
+    if _OLLAMA_CLIENT is None or _OLLAMA_CLIENT.is_closed:
+        # Fail fast when Ollama is down; generation itself may take up to 30s.
+        # The pool is sized well above OLLAMA_MAX_CONCURRENT so health checks
+        # and warm-up never wait on a free connection.
+        _OLLAMA_CLIENT = httpx.AsyncClient(
+            base_url=OLLAMA_BASE_URL,
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=40, keepalive_expiry=30.0),
+        )
+    return _OLLAMA_CLIENT
+
+
+async def close_ollama_client() -> None:
+    """Close the pooled Ollama connections"""
+    if _OLLAMA_CLIENT is not None:
+        await _OLLAMA_CLIENT.aclose()
+
+
+async def check_ollama_available() -> bool:
+    """Check that the Ollama server answers on /api/tags"""
+    try:
+        response = await get_ollama_client().get("/api/tags", timeout=5)
+        if response.status_code != 200:
+            logger.warning(f"Ollama returned status {response.status_code}")
+            return False
+        return True
+    except Exception as e:
+        logger.error(f"Ollama not available: {e}")
+        return False
+
+
+async def prime_system_prompt() -> None:
+    """Load the model and prefill SYSTEM_PROMPT once, so the first chat reuses its cached KV state
+
+    Ollama tokenizes server-side, so this is the closest thing to pre-tokenizing
+    the shared prefix: later calls with the same system prompt skip its prefill.
+    Loading a model from disk can take minutes, hence the longer timeout.
+    """
+    url, payload = _ollama_request(" ", SYSTEM_PROMPT, stream=False, max_tokens=1, deterministic=True)
+    try:
+        response = await get_ollama_client().post(url, json=payload, timeout=300)
+        response.raise_for_status()
+        # Ollama reports durations in nanoseconds; log them once as a baseline
+        # for comparing quantizations and thread/GPU settings.
+        stats = orjson.loads(response.content)
+        prompt_tokens = stats.get("prompt_eval_count", 0)
+        prompt_ns = stats.get("prompt_eval_duration", 0)
+        rate = f"{prompt_tokens / (prompt_ns / 1e9):.1f} tok/s" if prompt_ns else "n/a"
+        logger.info(
+            f"Ollama model {OLLAMA_MODEL} loaded in {stats.get('load_duration', 0) / 1e9:.1f}s, "
+            f"system prompt cached ({prompt_tokens} tokens, prefill {rate})"
+        )
+        await log_model_placement()
+    except Exception as e:
+        logger.warning(f"Ollama warm-up failed: {e}")
+
+
+async def log_model_placement() -> None:
+    """Log how much of the loaded model Ollama placed in VRAM (same as `ollama ps`)"""
+    try:
+        response = await get_ollama_client().get("/api/ps", timeout=5)
+        response.raise_for_status()
+        for model in orjson.loads(response.content).get("models", []):
+            size = model.get("size") or 0
+            gpu_share = 100 * model.get("size_vram", 0) // size if size else 0
+            logger.info(f"Ollama model {model.get('name')}: {gpu_share}% GPU")
+            if gpu_share == 0:
+                logger.warning("Ollama is running on CPU only; see OLLAMA_SETUP.md (GPU Offload)")
+    except Exception as e:
+        logger.debug(f"Could not read Ollama model placement: {e}")
+
+
+def _ollama_request(
+    prompt: str,
+    system: Optional[str],
+    stream: bool,
+    max_tokens: int,
+    json_mode: bool = False,
+    json_schema: Optional[dict] = None,
+    deterministic: bool = False,
+    stop: Optional[List[str]] = None,
+) -> Tuple[str, dict]:
+    """Build the Ollama /api/generate path and payload
+
+    The system prompt is sent separately so every call shares the same prefix:
+    Ollama then reuses the cached KV state of that prefix instead of prefilling
+    it again, and keep_alive keeps the model (and its cache) loaded.
+    """
+    # Sampling and runtime settings must go under "options" to be honoured.
+    # mmap + mlock keep the quantized weights paged in between requests.
+    # Never ask for more tokens than the context window has left: past that
+    # Ollama shifts the context, which costs a full re-prefill
+    used = estimate_tokens(prompt) + _TEMPLATE_TOKENS
+    if system:
+        used += SYSTEM_PROMPT_TOKENS if system is SYSTEM_PROMPT else estimate_tokens(system)
+    options = {
+        "temperature": 0.1,
+        "top_p": 0.9,
+        "num_predict": max(1, min(max_tokens, OLLAMA_NUM_CTX - used)),
+        "num_ctx": OLLAMA_NUM_CTX,
+        "num_batch": OLLAMA_NUM_BATCH,
+        "use_mmap": True,
+        "use_mlock": OLLAMA_USE_MLOCK,
+    }
+    if deterministic:
+        options.update(GREEDY_SAMPLING)
+    if OLLAMA_NUM_THREAD:
+        options["num_thread"] = int(OLLAMA_NUM_THREAD)
+    if OLLAMA_NUM_GPU:
+        options["num_gpu"] = int(OLLAMA_NUM_GPU)
+    if stop:
+        # End decoding as soon as the expected output is complete
+        options["stop"] = stop
+
+    payload = {
+        "model": OLLAMA_MODEL,
+        "prompt": prompt,
+        "stream": stream,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": options,
+    }
+    if system:
+        payload["system"] = system
+    if json_schema:
+        # Constrained sampling: output always matches the schema (keys included)
+        payload["format"] = json_schema
+    elif json_mode:
+        # Constrained sampling: output is always valid JSON and ends at the closing brace
+        payload["format"] = "json"
+    return "/api/generate", payload
+
+
+async def call_ollama(
+    prompt: str,
+    max_tokens: int = 100,
+    system: Optional[str] = None,
+    json_mode: bool = False,
+    json_schema: Optional[dict] = None,
+    deterministic: bool = False,
+    stop: Optional[List[str]] = None,
+) -> str:
+    """Call Ollama API asynchronously
+
+    Use deterministic=True (greedy decoding) for extraction, where there is a
+    single right answer and sampling only adds noise. json_schema constrains
+    the output to a JSON Schema (json_mode only to any JSON object).
+    """
+    url, payload = _ollama_request(
+        prompt, system, stream=False, max_tokens=max_tokens,
+        json_mode=json_mode, json_schema=json_schema, deterministic=deterministic, stop=stop
+    )
+
+    try:
+        async with _ollama_slot():
+            response = await get_ollama_client().post(url, json=payload)
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+        return data.get("response", "").strip()
     except Exception as e:
         logger.error(f"Ollama API error: {e}")
         return ""
 
 
+async def stream_ollama(
+    prompt: str, max_tokens: int = 100, system: Optional[str] = None, status: Optional[dict] = None
+) -> AsyncIterator[str]:
+    """Call Ollama API with streaming, yielding text chunks as they are decoded
+
+    Errors end the stream early; ``status["done"]`` is set only when Ollama
+    reported the end of the generation, so callers can tell a cut-off reply.
+    """
+    url, payload = _ollama_request(prompt, system, stream=True, max_tokens=max_tokens)
+
+    try:
+        async with _ollama_slot(), get_ollama_client().stream("POST", url, json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = orjson.loads(line)
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    if status is not None:
+                        status["done"] = True
+                    break
+    except Exception as e:
+        logger.error(f"Ollama streaming error: {e}")
+
+
+@lru_cache(maxsize=256)
 def normalize_key(key: str) -> str:
     """Normalize key by removing accents"""
-    import unicodedata
     nfd = unicodedata.normalize('NFD', key)
     return ''.join(c for c in nfd if unicodedata.category(c) != 'Mn').lower()
 
 
+# Values the model uses to say a field was not given; matched as prefixes
+_EMPTY_INDICATORS = (
+    'vide', 'absent', 'aucun', 'aucune',
+    'none', 'pas spécifié', 'pas specifie',
+    'pas mentionné', 'pas mentionne',
+    'n/a', 'na', 'non applicable',
+    'non fourni', 'non fournie',
+    'n\'est pas', 'n\'existe pas', 'n\'y a pas',
+    '[]', 'null', 'undefined',
+    'depuis no', 'since no',
+    'not provided', 'not specified',
+    'non indiqué', 'non indiquee',
+    'inconnu', 'inconnue',
+    'renseignement spécifique', 'renseignement specifique',
+    'consulter votre médecin', 'consulter votre medecin',
+    'consulter la notice',
+    'ne donne pas de',
+    'non spécifié', 'non specifie',
+)
+_EMPTY_RE = re.compile('|'.join(map(re.escape, _EMPTY_INDICATORS)))
+
+
+# Outermost {...} object with up to one level of nesting, for output wrapped in prose
+_JSON_OBJECT_RE = re.compile(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}')
+
+
+def parse_json_object(text: str) -> Optional[dict]:
+    """Parse a JSON object from model output, tolerating text around it (None if absent)"""
+    try:
+        parsed = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        match = _JSON_OBJECT_RE.search(text)
+        if not match:
+            return None
+        try:
+            parsed = orjson.loads(match.group(0))
+        except orjson.JSONDecodeError:
+            return None
+    return parsed if isinstance(parsed, dict) else None
+
+
 def is_empty_response(value: str) -> bool:
     """Check if response indicates field is empty"""
     if not value:
@@ -199,28 +547,8 @@ def is_empty_response(value: str) -> bool:
 
     normalized = value.lower().strip()
 
-    empty_indicators = [
-        'vide', 'absent', 'aucun', 'aucune',
-        'none', 'pas spécifié', 'pas specifie',
-        'pas mentionné', 'pas mentionne',
-        'n/a', 'na', 'non applicable',
-        'non fourni', 'non fournie',
-        'n\'est pas', 'n\'existe pas', 'n\'y a pas',
-        '[]', 'null', 'undefined',
-        'depuis no', 'since no',
-        'not provided', 'not specified',
-        'non indiqué', 'non indiquee',
-        'inconnu', 'inconnue',
-        'renseignement spécifique', 'renseignement specifique',
-        'consulter votre médecin', 'consulter votre medecin',
-        'consulter la notice',
-        'ne donne pas de',
-        'non spécifié', 'non specifie',
-    ]
-
-    for indicator in empty_indicators:
-        if normalized.startswith(indicator):
-            return True
+    if _EMPTY_RE.match(normalized):
+        return True
 
     if normalized.startswith('(') and normalized.endswith(')'):
         return True
@@ -231,149 +559,364 @@ def is_empty_response(value: str) -> bool:
     return False
 
 
+# Unambiguous markers that can be extracted without the LLM
+# "N ans" only counts as the age in an age context: "âgé(e) de", "âge :",
+# "patient(e)/homme/femme/enfant de", or right after "Patient: Jean Dupont,".
+# A bare "N ans" is usually a duration ("diabétique depuis 10 ans").
+_AGE_RE = re.compile(
+    r"(?:(?i:\b[âa]g[ée]e?s?\s+de|\b[âa]ge\s*[:\-]|\b(?:patiente?|homme|femme|enfant)\s+de)"
+    r"|(?i:\bpatiente?)\s*[:\-]?\s*(?:[A-ZÀ-Ý][\wÀ-ÿ'\-]*[ \t]*){1,4}[,(]?)"
+    r"\s*(\d{1,3})\s*(?i:ans)\b"
+)
+_DURATION_BEFORE_RE = re.compile(r"(?:depuis|pendant|durant|il y a)\s*$", re.IGNORECASE)
+_NAME_RE = re.compile(
+    r"(?i:\b(?:patiente?|nom(?: du patient)?))\s*[:\-]\s*([A-ZÀ-Ý][\wÀ-ÿ'\-]*(?:[ \t]+[A-ZÀ-Ý][\wÀ-ÿ'\-]*){0,3})"
+)
+
+
+def prefill_trivial_fields(text: str, current_data: PrescriptionData) -> PrescriptionData:
+    """Fill empty name/age fields from explicit markers ("âgé de 45 ans", "Patient: Jean Dupont", "Nom: ...")"""
+    if not current_data.patientAge:
+        match = _AGE_RE.search(text)
+        if match and not _DURATION_BEFORE_RE.search(text, 0, match.start(1)):
+            current_data.patientAge = f"{match.group(1)} ans"
+    if not current_data.patientName:
+        match = _NAME_RE.search(text)
+        if match:
+            current_data.patientName = sanitize_input(match.group(1), 200)
+    return current_data
+
+
+# Normalized extraction key -> (PrescriptionData attribute, max length)
+_FIELD_MAP = {
+    'nom': ('patientName', 200),
+    'name': ('patientName', 200),
+    'age': ('patientAge', 100),
+    'diagnostic': ('diagnosis', 500),
+    'diagnosis': ('diagnosis', 500),
+    'medicament': ('medication', 200),
+    'medication': ('medication', 200),
+    'dosage': ('dosage', 200),
+    'dosologie': ('dosage', 200),
+    'posologie': ('dosage', 200),
+    'duree': ('duration', 200),
+    'duration': ('duration', 200),
+    'instructions': ('specialInstructions', 500),
+    'instruction': ('specialInstructions', 500),
+}
+
+# Normalized extraction key -> list attribute for patient-record details
+_LIST_FIELD_MAP = {
+    'allergies': 'discovered_allergies',
+    'allergie': 'discovered_allergies',
+    'conditions': 'discovered_conditions',
+    'condition': 'discovered_conditions',
+}
+
+
+def apply_extracted_field(current_data: PrescriptionData, key: str, value: str) -> None:
+    """Store one extracted "key: value" pair on the prescription data"""
+    if is_empty_response(value):
+        logger.info("Skipping empty value for %s: %s", key, value)
+        return
+
+    normalized_key = normalize_key(key)
+
+    field = _FIELD_MAP.get(normalized_key)
+    if field:
+        attribute, max_length = field
+        setattr(current_data, attribute, sanitize_input(value, max_length))
+        return
+
+    # Allergies and chronic conditions - will be added to the patient record
+    attribute = _LIST_FIELD_MAP.get(normalized_key)
+    if attribute:
+        items_str = sanitize_input(value, 500)
+        if items_str and items_str.lower() not in ('aucune', 'none', 'no', 'non'):
+            setattr(current_data, attribute, [items_str])
+            logger.info("%s: %s", attribute, items_str)
+
+
+# "Label: value" lines, as emitted by the LLM or typed by the user in that format
+_LABEL_RE = re.compile(r'^[ \t]*([^\W\d_][^:\n]{0,30}?)[ \t]*:[ \t]*(\S.*?)[ \t]*$', re.MULTILINE)
+_LABELED_KEYS = frozenset(_FIELD_MAP) | frozenset(_LIST_FIELD_MAP)
+
+
+def apply_labeled_lines(text: str, current_data: PrescriptionData) -> bool:
+    """Apply "Label: value" lines from the message; True when every line was one"""
+    labeled = [
+        (key, value) for key, value in _LABEL_RE.findall(text)
+        if normalize_key(key) in _LABELED_KEYS
+    ]
+    for key, value in labeled:
+        apply_extracted_field(current_data, key, value)
+    return bool(labeled) and len(labeled) == sum(1 for line in text.splitlines() if line.strip())
+
+
+# LRU cache of parsed extraction results, keyed by a hash of the full prompt.
+# Entries expire after an hour; identical extractions already in flight are
+# shared instead of sent to Ollama twice.
+_LRU_CACHE_SIZE = 512
+_EXTRACTION_TTL = 3600
+_EXTRACTION_CACHE: "OrderedDict[bytes, Tuple[float, List[Tuple[str, str]]]]" = OrderedDict()
+_EXTRACTION_INFLIGHT: Dict[bytes, asyncio.Future] = {}
+
+
+# Hit/miss counters per cache, reported by /api/health
+_CACHE_STATS = {"extraction": {"hits": 0, "misses": 0}, "response": {"hits": 0, "misses": 0}}
+
+
+def _record_cache_lookup(name: str, hit: bool) -> None:
+    """Count one lookup in the named cache"""
+    _CACHE_STATS[name]["hits" if hit else "misses"] += 1
+
+
+def get_cache_stats() -> Dict[str, dict]:
+    """Size, hits, misses and hit rate of the LLM caches"""
+    sizes = {"extraction": len(_EXTRACTION_CACHE), "response": len(_RESPONSE_CACHE)}
+    stats = {}
+    for name, counts in _CACHE_STATS.items():
+        lookups = counts["hits"] + counts["misses"]
+        stats[name] = {
+            "size": sizes[name],
+            **counts,
+            "hit_rate": round(counts["hits"] / lookups, 3) if lookups else 0.0,
+        }
+    return stats
+
+
+def _lru_put(cache: OrderedDict, key, value) -> None:
+    """Store a value in an LRU cache, evicting the oldest entry when full"""
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > _LRU_CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+async def _run_extraction(prompt: str) -> Optional[List[Tuple[str, str]]]:
+    """Send one extraction prompt to Ollama and parse the labeled lines (None on failure)
+
+    No /api/tags probe first: call_ollama already returns "" when Ollama does
+    not answer, and the probe cost a round trip on every cache miss.
+    """
+    response = await call_ollama(
+        prompt, max_tokens=96, system=SYSTEM_PROMPT, deterministic=True, stop=EXTRACTION_STOP
+    )
+    logger.debug("Ollama response:\n%s", response)
+    return _LABEL_RE.findall(response) if response else None
+
+
+async def _cached_extraction(prompt: str) -> List[Tuple[str, str]]:
+    """Extraction pairs for a prompt, from the cache, an identical call in flight, or Ollama
+
+    Greedy decoding makes the output a pure function of the prompt, so a
+    retransmitted message is answered from the cache.
+    """
+    cache_key = hashlib.blake2b(prompt.encode(), digest_size=16).digest()
+    entry = _EXTRACTION_CACHE.get(cache_key)
+    hit = entry is not None and entry[0] > time.monotonic()
+    _record_cache_lookup("extraction", hit)
+    if hit:
+        _EXTRACTION_CACHE.move_to_end(cache_key)
+        return entry[1]
+
+    task = _EXTRACTION_INFLIGHT.get(cache_key)
+    if task is None:
+        task = _EXTRACTION_INFLIGHT[cache_key] = asyncio.ensure_future(_run_extraction(prompt))
+        task.add_done_callback(lambda _: _EXTRACTION_INFLIGHT.pop(cache_key, None))
+
+    # Shielded: a cancelled caller must not cancel the call other callers share
+    pairs = await asyncio.shield(task)
+    if pairs is None:
+        return []
+    _lru_put(_EXTRACTION_CACHE, cache_key, (time.monotonic() + _EXTRACTION_TTL, pairs))
+    return pairs
+
+
+# Acknowledgements and greetings carry no prescription facts: no extraction call
+_NO_FACTS_RE = re.compile(
+    r"^\W*(?:ok(?:ay)?|oui|merci(?: beaucoup)?|d['’]accord|bonjour|bonsoir|salut)?\W*$",
+    re.IGNORECASE,
+)
+
+# Fields repeated to the extraction model so it keeps them: (attribute, label, max length)
+_KNOWN_FIELDS = (
+    ('patientName', 'Patient actuel', 200),
+    ('patientAge', 'Age connu', 100),
+    ('diagnosis', 'Diagnostic connu', 200),
+    ('medication', 'Medicament connu', 200),
+)
+
+
 async def extract_data_from_message(text: str, current_data: PrescriptionData) -> PrescriptionData:
     """Extract prescription data using Ollama"""
-    # Check if Ollama is available
-    import os
-    OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-    try:
-        import requests
-        response = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5)
-        ollama_available = response.status_code == 200
-    except:
-        ollama_available = False
-
-    if not ollama_available:
-        logger.warning("Ollama not available, skipping extraction")
+    was_complete = current_data.is_complete()
+    current_data = prefill_trivial_fields(text, current_data)
+    if apply_labeled_lines(text, current_data):
+        logger.info("Message is only labeled fields, skipping LLM extraction")
+        return current_data
+    if not was_complete and current_data.is_complete():
+        # Completed by this message's explicit fields; corrections sent once
+        # the data is complete still go to the LLM
+        logger.info("All required fields known, skipping LLM extraction")
+        return current_data
+    if _NO_FACTS_RE.match(text):
+        logger.info("Message carries no prescription facts, skipping LLM extraction")
         return current_data
 
     safe_text = sanitize_input(text)
-    logger.info(f"Extracting from text: {safe_text[:100]}...")
-
-    existing_context = []
-    if current_data.patientName:
-        existing_context.append(f"Patient actuel: {sanitize_input(current_data.patientName, 200)}")
-    if current_data.patientAge:
-        existing_context.append(f"Age connu: {sanitize_input(current_data.patientAge, 100)}")
-    if current_data.diagnosis:
-        existing_context.append(f"Diagnostic connu: {sanitize_input(current_data.diagnosis, 200)}")
-    if current_data.medication:
-        existing_context.append(f"Medicament connu: {sanitize_input(current_data.medication, 200)}")
-
-    context_str = "\n".join(existing_context) if existing_context else ""
-
-    extraction_prompt = f"Tu extrais les informations medicales d'un message.\n\n"
-
-    if context_str:
-        extraction_prompt += (
-            f"CONTEXTE (informations deja collectees):\n"
-            f"{context_str}\n\n"
-            f"Conserve ces informations et ajoute les nouvelles du message suivant.\n\n"
-        )
+    logger.info("Extracting from text: %.100s...", safe_text)
 
-    extraction_prompt += (
-        f"NOUVEAU MESSAGE:\n{safe_text}\n\n"
-        f"REPONSE (9 lignes SEULEMENT, format exact):\n"
-        f"Nom:\nAge:\nDiagnostic:\nMedicament:\nDosage:\nDuree:\nInstructions:\nAllergies:\nConditions:"
-    )
+    # Fixed instructions first so they stay in the cached prefix
+    parts = [EXTRACTION_OUTPUT_FORMAT, "\n\n"]
+    known = [
+        f"{label}: {sanitize_input(getattr(current_data, field), max_length)}"
+        for field, label, max_length in _KNOWN_FIELDS if getattr(current_data, field)
+    ]
+    if known:
+        parts += ("DEJA CONNU (a conserver):\n", "\n".join(known), "\n\n")
+    parts += ("NOUVEAU MESSAGE:\n", safe_text, "\n\nREPONSE:\n")
+    extraction_prompt = "".join(parts)
 
     try:
-        response = await call_ollama(extraction_prompt, max_tokens=150)
-        logger.info(f"Ollama response:\n{response}")
-
-        for line in response.split('\n'):
-            line = line.strip()
-            if ':' not in line or not line:
-                continue
-
-            parts = line.split(':', 1)
-            if len(parts) != 2:
-                continue
-
-            key = parts[0].strip()
-            value = parts[1].strip()
-
-            if is_empty_response(value):
-                logger.info(f"Skipping empty value for {key}: {value}")
-                continue
-
-            normalized_key = normalize_key(key)
-
-            if normalized_key == 'nom' or normalized_key == 'name':
-                current_data.patientName = sanitize_input(value, 200)
-            elif normalized_key == 'age':
-                current_data.patientAge = sanitize_input(value, 100)
-            elif normalized_key == 'diagnostic' or normalized_key == 'diagnosis':
-                current_data.diagnosis = sanitize_input(value, 500)
-            elif normalized_key == 'medicament' or normalized_key == 'medication':
-                current_data.medication = sanitize_input(value, 200)
-            elif normalized_key in ['dosage', 'dosologie', 'posologie']:
-                current_data.dosage = sanitize_input(value, 200)
-            elif normalized_key in ['duree', 'duration', 'durée']:
-                current_data.duration = sanitize_input(value, 200)
-            elif normalized_key == 'instructions' or normalized_key == 'instruction':
-                current_data.specialInstructions = sanitize_input(value, 500)
-            elif normalized_key in ['allergies', 'allergie']:
-                # Store allergies - will be added to patient record
-                allergies_str = sanitize_input(value, 500)
-                if not hasattr(current_data, 'discovered_allergies'):
-                    current_data.discovered_allergies = []
-                if allergies_str and allergies_str.lower() not in ['aucune', 'none', 'no', 'non']:
-                    current_data.discovered_allergies = [allergies_str]
-                    logger.info(f"Discovered allergies: {allergies_str}")
-            elif normalized_key in ['conditions', 'condition']:
-                # Store chronic conditions - will be added to patient record
-                conditions_str = sanitize_input(value, 500)
-                if not hasattr(current_data, 'discovered_conditions'):
-                    current_data.discovered_conditions = []
-                if conditions_str and conditions_str.lower() not in ['aucune', 'none', 'no', 'non']:
-                    current_data.discovered_conditions = [conditions_str]
-                    logger.info(f"Discovered conditions: {conditions_str}")
-
+        for key, value in await _cached_extraction(extraction_prompt):
+            apply_extracted_field(current_data, key, value)
     except Exception as e:
         logger.error(f"Extraction error: {e}")
 
     return current_data
 
 
+def _build_turn_prompt(instructions: str, user_message: str, prescription_data: PrescriptionData) -> str:
+    """Build a chat-turn prompt: static instructions, then the collection state and message"""
+    return "".join((
+        instructions,
+        "\n\nInformations collectees:\n", prescription_data.format_display(),
+        "\n\nInformations manquantes:\n", ", ".join(prescription_data.get_missing_fields()) or "Aucun",
+        "\n\nMessage utilisateur: ", sanitize_input(user_message, 2000),
+    ))
+
+
+def build_response_prompt(user_message: str, prescription_data: PrescriptionData) -> str:
+    """Build the prompt for the conversational response"""
+    return _build_turn_prompt(RESPONSE_INSTRUCTIONS, user_message, prescription_data)
+
+
+# LRU cache of generated responses; replies are highly templated, so the same
+# message in the same collection state gets the same answer
+_RESPONSE_CACHE: "OrderedDict[tuple, str]" = OrderedDict()
+
+
+def _response_cache_key(user_message: str, prescription_data: PrescriptionData) -> tuple:
+    """Cache key: missing fields + hash of collected data and normalized message
+
+    Collected data is part of the key because replies quote it back.
+    """
+    normalized = " ".join(re.sub(r"[^\w\s]", " ", user_message.lower()).split())
+    digest = hashlib.blake2b(
+        f"{prescription_data.format_display()}\n{normalized}".encode(), digest_size=8
+    ).digest()
+    return frozenset(prescription_data.get_missing_fields()), digest
+
+
 async def generate_response(user_message: str, prescription_data: PrescriptionData) -> str:
     """Generate conversational response using Ollama"""
-    import os
-    OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-    try:
-        import requests
-        response = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5)
-        ollama_available = response.status_code == 200
-    except:
-        ollama_available = False
-
-    if not ollama_available:
-        return "Erreur: Ollama non disponible"
-
-    safe_user_message = sanitize_input(user_message, 2000)
-    collected = prescription_data.format_display()
-    missing = ", ".join(prescription_data.get_missing_fields()) or "Aucun"
-
-    prompt = (
-        f"{SYSTEM_PROMPT}\n\n"
-        f"Informations collectees:\n{collected}\n\n"
-        f"Informations manquantes:\n{missing}\n\n"
-        f"Message utilisateur: {safe_user_message}\n\n"
-        f"Reponds en francais. Confirme les infos recues et demande les infos manquantes."
-    )
+    if prescription_data.is_complete():
+        return COMPLETE_RESPONSE
+
+    cache_key = _response_cache_key(user_message, prescription_data)
+    cached = _RESPONSE_CACHE.get(cache_key)
+    _record_cache_lookup("response", cached is not None)
+    if cached is not None:
+        _RESPONSE_CACHE.move_to_end(cache_key)
+        return cached
+
+    prompt = build_response_prompt(user_message, prescription_data)
 
     try:
-        response = await call_ollama(prompt, max_tokens=256)
-        return response if response else "Je n'ai pas pu générer une réponse."
+        response = await call_ollama(prompt, max_tokens=REPLY_MAX_TOKENS, system=SYSTEM_PROMPT)
+        if not response:
+            return "Je n'ai pas pu générer une réponse."
+        _lru_put(_RESPONSE_CACHE, cache_key, response)
+        return response
     except Exception as e:
         logger.error(f"Response generation error: {e}")
         return f"Erreur: {str(e)}"
 
 
-def format_chat_prompt(user_message: str) -> str:
-    """Format prompt using TinyLlama chat template"""
-    return (
-        f"<|system|>\n{SYSTEM_PROMPT}</s>\n"
-        f"<|user|>\n{user_message}</s>\n"
-        f"<|assistant|>\n"
+async def stream_response(user_message: str, prescription_data: PrescriptionData) -> AsyncIterator[str]:
+    """Stream the conversational response from Ollama chunk by chunk"""
+    if prescription_data.is_complete():
+        yield COMPLETE_RESPONSE
+        return
+
+    cache_key = _response_cache_key(user_message, prescription_data)
+    cached = _RESPONSE_CACHE.get(cache_key)
+    _record_cache_lookup("response", cached is not None)
+    if cached is not None:
+        _RESPONSE_CACHE.move_to_end(cache_key)
+        yield cached
+        return
+
+    prompt = build_response_prompt(user_message, prescription_data)
+    chunks = []
+    status = {}
+    async for chunk in stream_ollama(prompt, max_tokens=REPLY_MAX_TOKENS, system=SYSTEM_PROMPT, status=status):
+        chunks.append(chunk)
+        yield chunk
+
+    # A stream cut off by an error must not be served again as the reply
+    if chunks and status.get("done"):
+        _lru_put(_RESPONSE_CACHE, cache_key, "".join(chunks).strip())
+
+
+async def extract_and_respond(user_message: str, current_data: PrescriptionData) -> Tuple[PrescriptionData, str]:
+    """Extract prescription data and generate the reply with a single Ollama call
+
+    Each turn is stateless: the prompt carries the collected data, and the
+    shared system prompt prefix stays in Ollama's KV cache.
+
+    Falls back to extract_data_from_message + generate_response (run
+    concurrently) when the model output is not the expected JSON object.
+    """
+    was_complete = current_data.is_complete()
+    current_data = prefill_trivial_fields(user_message, current_data)
+    apply_labeled_lines(user_message, current_data)
+    if not was_complete and current_data.is_complete():
+        # This message's explicit fields completed the prescription: nothing
+        # left to ask. Later messages (corrections, allergies) still reach the LLM.
+        return current_data, COMPLETE_RESPONSE
+
+    prompt = _build_turn_prompt(FUSED_OUTPUT_FORMAT, user_message, current_data)
+
+    try:
+        response = await call_ollama(
+            prompt, max_tokens=FUSED_MAX_TOKENS, system=SYSTEM_PROMPT, json_schema=FUSED_OUTPUT_SCHEMA
+        )
+        logger.debug("Ollama response:\n%s", response)
+
+        parsed = parse_json_object(response)
+        if parsed is None:
+            raise ValueError("no JSON object in the response")
+        extracted = parsed.get("extracted") or {}
+        reply = parsed.get("reply")
+        if not isinstance(extracted, dict) or not isinstance(reply, str) or not reply.strip():
+            raise ValueError("missing 'extracted' or 'reply'")
+
+        for key, value in extracted.items():
+            if isinstance(value, list):
+                value = ", ".join(str(v) for v in value if v)
+            apply_extracted_field(current_data, str(key), str(value or "").strip())
+
+        return current_data, reply.strip()
+
+    except (ValueError, AttributeError) as e:
+        logger.warning("Fused extraction failed (%s), falling back to separate calls", e)
+
+    # Both calls only need the user message: run them concurrently. The reply
+    # works from a snapshot of the data as it was before this message.
+    current_data, response_text = await asyncio.gather(
+        extract_data_from_message(user_message, current_data),
+        generate_response(user_message, current_data.model_copy()),
     )
+    return current_data, response_text
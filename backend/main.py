@@ -3,23 +3,30 @@ Vocalis Backend - Healthcare Device Delivery Platform
 Multi-user system with authentication, prescriptions, and LLM-powered assistance
 """
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Header, UploadFile, File, WebSocket, WebSocketDisconnect, Form, status, Request
+from fastapi import FastAPI, HTTPException, Depends, Header, UploadFile, File, WebSocket, WebSocketDisconnect, Form, status, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import Response, StreamingResponse
 from slowapi.errors import RateLimitExceeded
 from sqlalchemy.orm import Session
 from contextlib import asynccontextmanager
 import os
 import logging
 import asyncio
+import time
+import io
+import secrets
 import tempfile
 import uuid
 import uvicorn
 import json
+import orjson
 from datetime import datetime, timedelta, timezone
-from typing import Optional, List
+from collections import OrderedDict
+from typing import Optional, List, Tuple
 from haversine import haversine, Unit
 from jose import jwt
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
 
 # Local imports
 from database import get_db, get_db_for_user, init_db, prod_engine, Base, DEMO_ACCOUNT_EMAIL, DemoSessionLocal
@@ -51,7 +58,7 @@ from schemas import (
 )
 from auth import (
     hash_password, verify_password, create_access_token, create_refresh_token, verify_token, verify_refresh_token,
-    TokenData, validate_jwt_secret, REFRESH_TOKEN_EXPIRATION_DAYS, JWT_EXPIRATION_HOURS
+    TokenData, validate_jwt_secret, REFRESH_TOKEN_EXPIRATION_DAYS, JWT_EXPIRATION_HOURS, ENVIRONMENT
 )
 from voice_utils import (
     transcribe_audio, validate_medication, parse_prescription_text, structure_prescription_data
@@ -61,8 +68,9 @@ from voice_utils import (
 from llm_utils import (
     sanitize_input, validate_signature_image, SYSTEM_PROMPT,
     is_empty_response, normalize_key, call_ollama, extract_data_from_message,
-    generate_response, cleanup_temp_file, PrescriptionData, ChatRequest, ChatResponse,
-    GeneratePDFRequest, format_chat_prompt
+    extract_and_respond, stream_response, PrescriptionData, ChatRequest, ChatResponse,
+    GeneratePDFRequest, check_ollama_available, OLLAMA_BASE_URL, OLLAMA_MODEL,
+    close_ollama_client, prime_system_prompt, get_ollama_load, get_cache_stats, estimate_tokens, MAX_MESSAGE_TOKENS
 )
 
 # Rate limiting
@@ -75,14 +83,77 @@ logging.basicConfig(
 )
 logger = logging.getLogger("vocalis-backend")
 
-# Ollama configuration
-OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "mistral")
+# Ollama availability (configuration lives in llm_utils)
 ollama_available = False
 
-# Session storage for LLM interaction (per user, per session)
-session_data = {}
-session_lock = asyncio.Lock()
+# Chat sessions, least recently used first. Session ids are chosen by the
+# client, so the store is bounded: idle sessions expire, each user keeps at
+# most MAX_SESSIONS_PER_USER and the whole store MAX_CHAT_SESSIONS.
+MAX_CHAT_SESSIONS = int(os.getenv("MAX_CHAT_SESSIONS", "1000"))
+MAX_SESSIONS_PER_USER = int(os.getenv("MAX_SESSIONS_PER_USER", "10"))
+CHAT_SESSION_TTL = int(os.getenv("CHAT_SESSION_TTL", "7200"))
+
+
+class ChatSession:
+    """One chat session: collected data and the lock serializing its turns
+    (different sessions reach Ollama concurrently, see OLLAMA_MAX_CONCURRENT)"""
+
+    __slots__ = ("data", "lock", "last_used")
+
+    def __init__(self):
+        self.data = PrescriptionData()
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+
+chat_sessions: "OrderedDict[Tuple[str, str], ChatSession]" = OrderedDict()
+
+
+def _evict_chat_sessions() -> None:
+    """Drop idle sessions past CHAT_SESSION_TTL, then the oldest beyond MAX_CHAT_SESSIONS"""
+    deadline = time.monotonic() - CHAT_SESSION_TTL
+    remaining = len(chat_sessions)
+    stale = []
+    for key, session in chat_sessions.items():
+        if remaining <= MAX_CHAT_SESSIONS and session.last_used > deadline:
+            break  # LRU order: every later session is more recent
+        if not session.lock.locked():  # never drop a turn in progress
+            stale.append(key)
+            remaining -= 1
+    for key in stale:
+        del chat_sessions[key]
+
+
+def get_chat_session(user: User, session_id: str, create: bool = True) -> Optional[ChatSession]:
+    """Get a user's chat session (created unless create=False); ids never cross accounts"""
+    _evict_chat_sessions()
+    key = (user.id, session_id)
+    session = chat_sessions.get(key)
+    if session is None:
+        if not create:
+            return None
+        # Make room for the new session among this user's, oldest first
+        user_keys = [k for k in chat_sessions if k[0] == user.id]
+        excess = len(user_keys) - MAX_SESSIONS_PER_USER + 1
+        for k in user_keys[:max(excess, 0)]:
+            if not chat_sessions[k].lock.locked():
+                del chat_sessions[k]
+        session = chat_sessions[key] = ChatSession()
+    else:
+        chat_sessions.move_to_end(key)
+        session.last_used = time.monotonic()
+    return session
+
+
+# Whisper runs in a worker thread so the event loop keeps serving other
+# requests; one transcription at a time, as it already uses every CPU core
+whisper_lock = asyncio.Lock()
+
+
+async def transcribe_in_thread(audio_path: str, language: str = "fr") -> Tuple[str, float]:
+    """Transcribe an audio file off the event loop"""
+    async with whisper_lock:
+        return await asyncio.to_thread(transcribe_audio, audio_path, language=language)
 
 
 # ============================================================================
@@ -161,21 +232,20 @@ async def lifespan(app: FastAPI):
 
     # Check Ollama availability
     logger.info(f"Checking Ollama at {OLLAMA_BASE_URL} with model {OLLAMA_MODEL}...")
-    try:
-        import requests
-        response = requests.get(f"{OLLAMA_BASE_URL}/api/tags", timeout=5)
-        if response.status_code == 200:
-            ollama_available = True
-            logger.info("Ollama is available!")
-        else:
-            logger.warning(f"Ollama returned status {response.status_code}")
-    except Exception as e:
-        logger.error(f"Ollama not available: {e}")
+    ollama_available = await check_ollama_available()
+    warmup = None
+    if ollama_available:
+        logger.info("Ollama is available!")
+        # Load the model in the background: the API starts serving right away
+        warmup = asyncio.create_task(prime_system_prompt())
 
     yield
 
     logger.info("Shutting down...")
     ollama_available = False
+    if warmup:
+        warmup.cancel()
+    await close_ollama_client()
 
 
 # ============================================================================
@@ -242,22 +312,29 @@ def get_cors_origins() -> List[str]:
 # Get allowed origins and configure CORS
 cors_origins = get_cors_origins()
 
-# For development, also allow all localhost:* ports with regex
-# This handles Flutter's dynamic port allocation
-allow_origin_regex = "http://localhost(:\\d+)?|http://127\\.0\\.0\\.1(:\\d+)?"
+# For development, also allow all localhost:* ports with regex.
+# This handles Flutter's dynamic port allocation; in production the check stays
+# a plain set lookup and localhost is not implicitly trusted.
+allow_origin_regex = (
+    None if ENVIRONMENT in ["production", "prod"]
+    else "http://localhost(:\\d+)?|http://127\\.0\\.0\\.1(:\\d+)?"
+)
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=cors_origins,
     allow_origin_regex=allow_origin_regex,  # Regex for localhost:* ports
     allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],  # Explicit methods
+    allow_methods=["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"],  # Explicit methods
     allow_headers=["Content-Type", "Authorization"],  # Only required headers
     expose_headers=["Content-Length"],
-    max_age=3600,  # Cache preflight for 1 hour
+    max_age=86400,  # Cache preflight for 24 hours (browsers may cap it lower)
 )
 
-logger.info(f"CORS middleware configured with {len(cors_origins)} allowed origin(s) and regex pattern for localhost:*")
+logger.info(
+    f"CORS middleware configured with {len(cors_origins)} allowed origin(s)"
+    + (" and regex pattern for localhost:*" if allow_origin_regex else "")
+)
 
 
 # ============================================================================
@@ -318,12 +395,7 @@ async def get_current_user(
     if not token_data:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
 
-    # Use appropriate database based on email
-    if token_data.email.lower() == DEMO_ACCOUNT_EMAIL.lower():
-        db.close()  # Close the default production db session
-        db_generator = get_db_for_user(token_data.email)
-        db = next(db_generator)
-
+    # db is already the demo or production session for this token (get_db_for_request)
     user = db.query(User).filter(
         User.id == token_data.user_id,
         User.org_id == token_data.org_id
@@ -1838,7 +1910,9 @@ async def health_check():
         "database": "connected",
         "ollama_available": ollama_available,
         "ollama_url": OLLAMA_BASE_URL,
-        "model": OLLAMA_MODEL
+        "model": OLLAMA_MODEL,
+        "ollama_load": get_ollama_load(),
+        "llm_cache": get_cache_stats()
     }
 
 
@@ -2150,6 +2224,15 @@ async def clear_queue_item(
 # CHAT ENDPOINT (requires authentication)
 # ============================================================================
 
+def check_message_length(message: str):
+    """Reject chat messages that would not fit the model context (before any LLM work)"""
+    if estimate_tokens(message) > MAX_MESSAGE_TOKENS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail="Message trop long"
+        )
+
+
 @app.post("/api/chat", response_model=ChatResponse)
 @limiter.limit(RateLimits.CHAT_MESSAGE)
 async def chat(
@@ -2165,27 +2248,23 @@ async def chat(
             detail="Ollama n'est pas disponible. Veuillez démarrer Ollama."
         )
 
+    check_message_length(chat_request.message)
+
     try:
         # Use user-specific session storage
-        session_key = f"{current_user.id}:chat_session"
-        async with session_lock:
-            session = session_data.get(session_key, {})
-            current_data = PrescriptionData(**session) if session else PrescriptionData()
-
-            # Extract information from user message
-            current_data = await extract_data_from_message(chat_request.message, current_data)
-
-            # Save updated data to session
-            session_data[session_key] = current_data.model_dump(exclude_none=True)
-
-        # Generate response
-        response_text = await generate_response(chat_request.message, current_data)
+        session = get_chat_session(current_user, chat_request.session_id)
+        async with session.lock:
+            # Extract information and generate the response in one LLM call
+            current_data, response_text = await extract_and_respond(chat_request.message, session.data)
+            session.data = current_data
 
+        missing_fields = current_data.get_missing_fields()
         return ChatResponse(
             response=response_text,
-            is_complete=current_data.is_complete(),
-            missing_fields=current_data.get_missing_fields(),
-            prescription_data=current_data
+            is_complete=not missing_fields,
+            missing_fields=missing_fields,
+            prescription_data=current_data,
+            session_id=chat_request.session_id
         )
 
     except Exception as e:
@@ -2193,16 +2272,121 @@ async def chat(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/chat/stream")
+@limiter.limit(RateLimits.CHAT_MESSAGE)
+async def chat_stream(
+    request: Request,
+    chat_request: ChatRequest,
+    current_user: User = Depends(get_current_user)
+):
+    """Chat endpoint streaming the LLM response as Server-Sent Events
+
+    Emits `data: {"delta": "..."}` frames while the response is decoded, then a
+    final `data: {"done": true, ...}` frame carrying the full ChatResponse, with
+    the fields extracted from this message.
+    """
+
+    if not ollama_available:
+        raise HTTPException(
+            status_code=503,
+            detail="Ollama n'est pas disponible. Veuillez démarrer Ollama."
+        )
+
+    check_message_length(chat_request.message)
+
+    async def event_stream():
+        session = get_chat_session(current_user, chat_request.session_id)
+        async with session.lock:
+            current_data = session.data
+
+            # Extract in the background while the reply streams: the first
+            # token no longer waits for a whole extraction call. The reply
+            # works from the data as it was before this message.
+            extraction = asyncio.create_task(
+                extract_data_from_message(chat_request.message, current_data)
+            )
+            try:
+                chunks = []
+                async for chunk in stream_response(chat_request.message, current_data.model_copy()):
+                    chunks.append(chunk)
+                    yield b"data: " + orjson.dumps({"delta": chunk}) + b"\n\n"
+
+                current_data = await extraction
+            finally:
+                extraction.cancel()
+            session.data = current_data
+
+        missing_fields = current_data.get_missing_fields()
+        final = ChatResponse(
+            response="".join(chunks).strip() or "Je n'ai pas pu générer une réponse.",
+            is_complete=not missing_fields,
+            missing_fields=missing_fields,
+            prescription_data=current_data,
+            session_id=chat_request.session_id
+        )
+        yield b"data: " + orjson.dumps({"done": True, **final.model_dump()}) + b"\n\n"
+
+    # Keep proxies (nginx) from buffering the frames, or the client only sees
+    # the reply once it is complete
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # ============================================================================
 # PDF GENERATION ENDPOINT
 # ============================================================================
 
+# The core PDF fonts only cover latin-1: spell out the common French
+# characters outside it instead of failing the whole document
+_PDF_CHARMAP = str.maketrans({
+    "œ": "oe", "Œ": "OE", "’": "'", "‘": "'", "“": '"', "”": '"',
+    "–": "-", "—": "-", "…": "...", "€": "EUR", "\u202f": " ",
+})
+
+
+def _render_pdf(prescription_text: str, img_bytes: Optional[bytes], has_signature: bool) -> bytes:
+    """Render the prescription PDF in memory (blocking, run in a worker thread)"""
+    prescription_text = (
+        prescription_text.translate(_PDF_CHARMAP).encode("latin-1", "replace").decode("latin-1")
+    )
+
+    pdf = FPDF()
+    pdf.add_page()
+
+    # Title
+    pdf.set_font("Helvetica", "B", 14)
+    pdf.cell(0, 10, "ORDONNANCE MEDICALE", new_x=XPos.LMARGIN, new_y=YPos.NEXT, align="C")
+    pdf.ln(5)
+
+    # Content (one text block; wraps long lines)
+    pdf.set_font("Helvetica", size=10)
+    pdf.multi_cell(0, 5, prescription_text, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+    pdf.ln(10)
+
+    # Signature (decoded PNG bytes, no temp file)
+    if img_bytes:
+        try:
+            pdf.cell(0, 5, "Signature:", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            pdf.image(io.BytesIO(img_bytes), w=50)
+
+        except Exception as e:
+            logger.error(f"Signature processing error: {e}")
+            pdf.cell(0, 5, "[Signature Error]", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    elif has_signature:
+        pdf.cell(0, 5, "[Invalid Signature]", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+    return bytes(pdf.output())
+
+
 @app.post("/api/generate-pdf")
 @limiter.limit(RateLimits.PDF_GENERATE)
 async def generate_pdf(
     request: Request,
     pdf_request: GeneratePDFRequest,
-    background_tasks: BackgroundTasks,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db_for_request)
 ):
@@ -2211,17 +2395,17 @@ async def generate_pdf(
     logger.info(f"PDF generation request from {current_user.email}")
 
     try:
-        from fpdf import FPDF
-
         # Get session data
-        session_key = f"{current_user.id}:chat_session"
-        async with session_lock:
-            session = session_data.get(session_key, {})
-            current_data = PrescriptionData(**session) if session else PrescriptionData()
+        session = get_chat_session(current_user, pdf_request.session_id, create=False)
+        current_data = PrescriptionData()
+        if session:
+            async with session.lock:
+                current_data = session.data
 
         # Check if complete
-        if not current_data.is_complete():
-            missing = ", ".join(current_data.get_missing_fields())
+        missing_fields = current_data.get_missing_fields()
+        if missing_fields:
+            missing = ", ".join(missing_fields)
             raise HTTPException(
                 status_code=400,
                 detail=f"Données incomplètes: {missing}"
@@ -2252,56 +2436,27 @@ Date: {datetime.now().strftime('%d/%m/%Y')}
 Médecin: {current_user.full_name}
 """
 
-        # Create PDF
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=11)
-
-        # Title
-        pdf.set_font("Arial", "B", 14)
-        pdf.cell(0, 10, "ORDONNANCE MEDICALE", ln=True, align="C")
-        pdf.ln(5)
-
-        # Content
-        pdf.set_font("Arial", size=10)
-        for line in prescription_text.split("\n"):
-            pdf.cell(0, 5, line, ln=True)
-
-        pdf.ln(10)
-
-        # Signature (with validation)
-        sig_temp_path = None
+        # Validate signature and render PDF off the event loop
+        img_bytes = None
         if pdf_request.signature_base64:
-            img_bytes = validate_signature_image(pdf_request.signature_base64)
-            if img_bytes:
-                try:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-                        tmp.write(img_bytes)
-                        sig_temp_path = tmp.name
-
-                    pdf.cell(0, 5, "Signature:", ln=True)
-                    pdf.image(sig_temp_path, w=50)
-
-                except Exception as e:
-                    logger.error(f"Signature processing error: {e}")
-                    pdf.cell(0, 5, "[Signature Error]", ln=True)
-            else:
+            img_bytes = await asyncio.to_thread(validate_signature_image, pdf_request.signature_base64)
+            if not img_bytes:
                 logger.warning("Signature validation failed")
-                pdf.cell(0, 5, "[Invalid Signature]", ln=True)
-
-        # Save PDF
-        filename = f"ordonnance_{uuid.uuid4()}.pdf"
-        filepath = os.path.join(tempfile.gettempdir(), filename)
-        pdf.output(filepath)
 
-        # Schedule cleanup
-        if sig_temp_path:
-            background_tasks.add_task(cleanup_temp_file, sig_temp_path)
-        background_tasks.add_task(cleanup_temp_file, filepath)
+        pdf_bytes = await asyncio.to_thread(
+            _render_pdf, prescription_text, img_bytes, bool(pdf_request.signature_base64)
+        )
+        filename = f"ordonnance_{secrets.token_hex(8)}.pdf"
 
         logger.info(f"PDF generated: {filename}")
-        return FileResponse(filepath, filename=filename, media_type="application/pdf")
+        return Response(
+            content=pdf_bytes,
+            media_type="application/pdf",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("PDF generation error")
         raise HTTPException(status_code=500, detail=str(e))
@@ -2311,6 +2466,18 @@ Médecin: {current_user.full_name}
 # PATIENT MANAGEMENT ENDPOINTS (AI-Oriented App)
 # ============================================================================
 
+def _normalize_json_list(data):
+    """Decode a JSON list column; items stored as {"name": ...} dicts become plain names"""
+    if not data:
+        return None
+    parsed = orjson.loads(data)
+    if not parsed:
+        return None
+    if isinstance(parsed[0], dict) and 'name' in parsed[0]:
+        return [item['name'] for item in parsed]
+    return parsed
+
+
 @app.post("/api/patients", response_model=PatientResponse)
 async def create_patient(
     request: PatientCreate,
@@ -2338,18 +2505,6 @@ async def create_patient(
         db.commit()
         db.refresh(patient)
 
-        # Helper function to normalize allergy data
-        def normalize_list(data):
-            if not data:
-                return None
-            parsed = json.loads(data)
-            if not parsed:
-                return None
-            # If items are dicts with 'name' key, extract names; otherwise return as-is
-            if parsed and isinstance(parsed[0], dict) and 'name' in parsed[0]:
-                return [item['name'] for item in parsed]
-            return parsed
-
         # Convert JSON fields back to lists for response
         patient_dict = {
             "id": patient.id,
@@ -2360,9 +2515,9 @@ async def create_patient(
             "phone": patient.phone,
             "email": patient.email,
             "address": patient.address,
-            "allergies": normalize_list(patient.allergies),
-            "chronic_conditions": normalize_list(patient.chronic_conditions),
-            "current_medications": normalize_list(patient.current_medications),
+            "allergies": _normalize_json_list(patient.allergies),
+            "chronic_conditions": _normalize_json_list(patient.chronic_conditions),
+            "current_medications": _normalize_json_list(patient.current_medications),
             "medical_notes": patient.medical_notes,
             "created_at": patient.created_at
         }
@@ -2388,18 +2543,6 @@ async def get_patient(
         if not patient:
             raise HTTPException(status_code=404, detail="Patient not found")
 
-        # Helper function to normalize allergy data
-        def normalize_list(data):
-            if not data:
-                return None
-            parsed = json.loads(data)
-            if not parsed:
-                return None
-            # If items are dicts with 'name' key, extract names; otherwise return as-is
-            if parsed and isinstance(parsed[0], dict) and 'name' in parsed[0]:
-                return [item['name'] for item in parsed]
-            return parsed
-
         patient_dict = {
             "id": patient.id,
             "first_name": patient.first_name,
@@ -2409,9 +2552,9 @@ async def get_patient(
             "phone": patient.phone,
             "email": patient.email,
             "address": patient.address,
-            "allergies": normalize_list(patient.allergies),
-            "chronic_conditions": normalize_list(patient.chronic_conditions),
-            "current_medications": normalize_list(patient.current_medications),
+            "allergies": _normalize_json_list(patient.allergies),
+            "chronic_conditions": _normalize_json_list(patient.chronic_conditions),
+            "current_medications": _normalize_json_list(patient.current_medications),
             "medical_notes": patient.medical_notes,
             "created_at": patient.created_at
         }
@@ -2484,18 +2627,6 @@ async def list_patients(
 
         result = []
         for patient in patients:
-            # Helper function to normalize allergy data
-            def normalize_list(data):
-                if not data:
-                    return None
-                parsed = json.loads(data)
-                if not parsed:
-                    return None
-                # If items are dicts with 'name' key, extract names; otherwise return as-is
-                if parsed and isinstance(parsed[0], dict) and 'name' in parsed[0]:
-                    return [item['name'] for item in parsed]
-                return parsed
-
             patient_dict = {
                 "id": patient.id,
                 "first_name": patient.first_name,
@@ -2505,9 +2636,9 @@ async def list_patients(
                 "phone": patient.phone,
                 "email": patient.email,
                 "address": patient.address,
-                "allergies": normalize_list(patient.allergies),
-                "chronic_conditions": normalize_list(patient.chronic_conditions),
-                "current_medications": normalize_list(patient.current_medications),
+                "allergies": _normalize_json_list(patient.allergies),
+                "chronic_conditions": _normalize_json_list(patient.chronic_conditions),
+                "current_medications": _normalize_json_list(patient.current_medications),
                 "medical_notes": patient.medical_notes,
                 "created_at": patient.created_at
             }
@@ -2563,18 +2694,6 @@ async def update_patient(
         db.commit()
         db.refresh(patient)
 
-        # Helper function to normalize allergy data
-        def normalize_list(data):
-            if not data:
-                return None
-            parsed = json.loads(data)
-            if not parsed:
-                return None
-            # If items are dicts with 'name' key, extract names; otherwise return as-is
-            if parsed and isinstance(parsed[0], dict) and 'name' in parsed[0]:
-                return [item['name'] for item in parsed]
-            return parsed
-
         patient_dict = {
             "id": patient.id,
             "first_name": patient.first_name,
@@ -2584,9 +2703,9 @@ async def update_patient(
             "phone": patient.phone,
             "email": patient.email,
             "address": patient.address,
-            "allergies": normalize_list(patient.allergies),
-            "chronic_conditions": normalize_list(patient.chronic_conditions),
-            "current_medications": normalize_list(patient.current_medications),
+            "allergies": _normalize_json_list(patient.allergies),
+            "chronic_conditions": _normalize_json_list(patient.chronic_conditions),
+            "current_medications": _normalize_json_list(patient.current_medications),
             "medical_notes": patient.medical_notes,
             "created_at": patient.created_at
         }
@@ -2650,7 +2769,7 @@ async def transcribe_voice(
             buffer.write(content)
 
         # Transcribe using Whisper
-        text, confidence = transcribe_audio(temp_audio_path, language=language)
+        text, confidence = await transcribe_in_thread(temp_audio_path, language=language)
 
         logger.info(f"Transcription completed: {len(text)} chars, confidence: {confidence:.2%}")
 
@@ -2700,7 +2819,7 @@ async def create_voice_prescription(
                 content = await file.read()
                 buffer.write(content)
 
-            transcribed_text, _ = transcribe_audio(temp_audio_path, language="fr")
+            transcribed_text, _ = await transcribe_in_thread(temp_audio_path, language="fr")
 
         if not transcribed_text:
             raise HTTPException(status_code=400, detail="No audio provided or transcription failed")
@@ -2741,10 +2860,8 @@ async def create_voice_prescription(
                 status="draft"
             )
             db.add(prescription)
-            db.commit()
-            db.refresh(prescription)
 
-            # Update patient record with discovered allergies
+            # Update patient record with discovered allergies (same transaction)
             if structured.get("allergies"):
                 allergies_str = structured.get("allergies", "").strip()
                 if allergies_str and allergies_str.lower() not in ["aucune", "none", "no", "non"]:
@@ -2753,9 +2870,11 @@ async def create_voice_prescription(
                     # Deduplicate to avoid "allergie aux orthies" and "orthies" both being saved
                     patient_allergies = deduplicate_items(patient_allergies)
                     patient.allergies = json.dumps(patient_allergies)
-                    db.commit()
                     logger.info(f"Updated patient {patient.id} with allergy: {allergies_str} (deduplicated: {patient_allergies})")
 
+            db.commit()
+            db.refresh(prescription)
+
             prescription_response = PrescriptionResponse(
                 id=prescription.id,
                 patient_name=prescription.patient_name,
@@ -2864,10 +2983,8 @@ async def create_text_prescription(
                 status="draft"
             )
             db.add(prescription)
-            db.commit()
-            db.refresh(prescription)
 
-            # Update patient record with discovered allergies
+            # Update patient record with discovered allergies (same transaction)
             if structured.get("allergies"):
                 allergies_str = structured.get("allergies", "").strip()
                 if allergies_str and allergies_str.lower() not in ["aucune", "none", "no", "non"]:
@@ -2876,9 +2993,11 @@ async def create_text_prescription(
                     # Deduplicate to avoid "allergie aux orthies" and "orthies" both being saved
                     patient_allergies = deduplicate_items(patient_allergies)
                     patient.allergies = json.dumps(patient_allergies)
-                    db.commit()
                     logger.info(f"Updated patient {patient.id} with allergy: {allergies_str} (deduplicated: {patient_allergies})")
 
+            db.commit()
+            db.refresh(prescription)
+
             prescription_response = PrescriptionResponse(
                 id=prescription.id,
                 patient_name=prescription.patient_name,
@@ -2979,7 +3098,7 @@ async def create_intervention(
     )
 
 
-@app.get("/api/interventions")
+@app.get("/api/interventions", response_model=list[InterventionListResponse])
 async def list_interventions(
     prescription_id: Optional[str] = None,
     status: Optional[str] = None,
@@ -3259,7 +3378,7 @@ async def upload_intervention_document(
     )
 
 
-@app.get("/api/interventions/{intervention_id}/logs")
+@app.get("/api/interventions/{intervention_id}/logs", response_model=list[InterventionLogResponse])
 async def get_intervention_logs(
     intervention_id: str,
     current_user: User = Depends(get_current_user),
@@ -3291,7 +3410,7 @@ async def get_intervention_logs(
     ]
 
 
-@app.get("/api/interventions/{intervention_id}/documents")
+@app.get("/api/interventions/{intervention_id}/documents", response_model=list[InterventionDocumentResponse])
 async def get_intervention_documents(
     intervention_id: str,
     current_user: User = Depends(get_current_user),
@@ -3338,4 +3457,16 @@ async def get_intervention_documents(
 # ============================================================================
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8080, reload=True)
+    # uvicorn[standard] brings uvloop and httptools, picked up automatically.
+    # Always one worker, even if WEB_CONCURRENCY is set: chat sessions, rate
+    # limits and doctor websockets live in this process's memory. Inference
+    # runs in Ollama, so this async process is not the bottleneck.
+    is_production = ENVIRONMENT in ["production", "prod"]
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8080")),
+        reload=not is_production,
+        workers=1,
+        access_log=not is_production,
+    )
@@ -1,6 +1,6 @@
 """Pydantic schemas for request/response validation"""
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime, date
 from models import UserRole
@@ -144,8 +144,7 @@ class PrescriptionResponse(BaseModel):
     is_signed: bool
     doctor_signed_at: Optional[datetime] = None
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class DeviceResponse(BaseModel):
@@ -157,8 +156,7 @@ class DeviceResponse(BaseModel):
     description: Optional[str]
     status: str
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class PrescriptionDeviceCreate(BaseModel):
@@ -177,8 +175,7 @@ class PrescriptionDeviceResponse(BaseModel):
     instructions: Optional[str]
     priority: str
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class PrescriptionListResponse(BaseModel):
@@ -192,8 +189,7 @@ class PrescriptionListResponse(BaseModel):
     is_signed: bool
     doctor_signed_at: Optional[datetime] = None
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # ============================================================================
@@ -215,8 +211,7 @@ class OrganizationResponse(BaseModel):
     phone: Optional[str]
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # ============================================================================
@@ -239,8 +234,7 @@ class DeviceResponse(BaseModel):
     status: str
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # ============================================================================
@@ -280,8 +274,7 @@ class PatientVisitListResponse(BaseModel):
     status: str
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class PatientVisitDetailResponse(BaseModel):
@@ -309,8 +302,7 @@ class PatientVisitDetailResponse(BaseModel):
     patient_signature: Optional[str] = None
     completed_at: Optional[datetime] = None
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # ============================================================================
@@ -334,8 +326,7 @@ class NurseLocationResponse(BaseModel):
     accuracy: Optional[float]
     recorded_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # ============================================================================
@@ -349,8 +340,7 @@ class PhotoResponse(BaseModel):
     caption: Optional[str]
     uploaded_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # ============================================================================
@@ -380,8 +370,7 @@ class DeviceListResponse(BaseModel):
     status: str
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # ============================================================================
@@ -433,8 +422,7 @@ class OfflineQueueItem(BaseModel):
     synced_at: Optional[datetime] = None
     error_message: Optional[str] = None
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class OfflineSyncPush(BaseModel):
@@ -522,8 +510,7 @@ class PatientResponse(BaseModel):
     medical_notes: Optional[str]
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # ============================================================================
@@ -544,8 +531,7 @@ class MedicationResponse(BaseModel):
     max_age: Optional[int]
     description: Optional[str]
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # ============================================================================
@@ -636,8 +622,7 @@ class InterventionResponse(BaseModel):
     created_at: datetime
     updated_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class InterventionListResponse(BaseModel):
@@ -650,8 +635,7 @@ class InterventionListResponse(BaseModel):
     status: str
     created_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class InterventionLogCreate(BaseModel):
@@ -669,8 +653,7 @@ class InterventionLogResponse(BaseModel):
     notes: Optional[str]
     logged_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class InterventionDocumentCreate(BaseModel):
@@ -691,8 +674,7 @@ class InterventionDocumentResponse(BaseModel):
     caption: Optional[str]
     uploaded_at: datetime
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class InterventionDetailResponse(BaseModel):
@@ -709,8 +691,7 @@ class InterventionDetailResponse(BaseModel):
     updated_at: datetime
     logs: List[InterventionLogResponse] = []
 
-    class Config:
-        from_attributes = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # ============================================================================
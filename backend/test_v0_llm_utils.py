@@ -0,0 +1,545 @@
+"""
+Unit Tests for Vocalis LLM utilities
+No Ollama server required - calls go to a fake client where needed
+"""
+
+import pytest
+
+import asyncio
+import base64
+import sys
+import os
+
+import httpx
+import orjson
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(__file__))
+
+import llm_utils
+from llm_utils import (
+    PrescriptionData, ChatRequest, DEFAULT_SESSION_ID, COMPLETE_RESPONSE, MAX_SIGNATURE_BYTES,
+    prefill_trivial_fields, is_empty_response, apply_extracted_field, apply_labeled_lines,
+    validate_signature_image, generate_response, extract_and_respond, extract_data_from_message,
+    parse_json_object,
+    OLLAMA_NUM_CTX, OLLAMA_MAX_CONCURRENT, get_ollama_load, _ollama_request, _ollama_slot,
+    get_cache_stats, _response_cache_key, _RESPONSE_CACHE, stream_response,
+)
+
+
+class FakeOllamaClient:
+    """Stands in for the shared httpx client: records payloads, answers from a list"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.payloads = []
+        self.probes = []
+
+    async def get(self, url, **kwargs):
+        self.probes.append(url)
+        return httpx.Response(200, json={"models": []}, request=httpx.Request("GET", url))
+
+    async def post(self, url, json=None, **kwargs):
+        self.payloads.append(json)
+        await asyncio.sleep(0)
+        body = self.responses.pop(0) if self.responses else {"response": ""}
+        return httpx.Response(200, content=orjson.dumps(body), request=httpx.Request("POST", url))
+
+
+@pytest.fixture
+def fake_ollama(monkeypatch):
+    """Route Ollama calls to a FakeOllamaClient; set .responses before the call"""
+    client = FakeOllamaClient([])
+    monkeypatch.setattr(llm_utils, "get_ollama_client", lambda: client)
+    return client
+
+
+COMPLETE_DATA = dict(
+    patientName="Jean Dupont", patientAge="45 ans", diagnosis="Angine",
+    medication="Amoxicilline", dosage="500mg 3x/jour", duration="7 jours",
+    specialInstructions="Pendant les repas",
+)
+
+
+def fused_output(reply, **extracted):
+    """Ollama /api/generate body carrying a fused {"extracted", "reply"} answer"""
+    fields = dict.fromkeys(llm_utils._FUSED_EXTRACTED_KEYS, "")
+    fields.update(extracted)
+    return {"response": orjson.dumps({"extracted": fields, "reply": reply}).decode()}
+
+
+# ============================================================================
+# PRESCRIPTION DATA TESTS
+# ============================================================================
+
+class TestPrescriptionData:
+    """Test required-field bookkeeping"""
+
+    def test_missing_fields_in_order(self):
+        """Test that missing fields are listed in prompt order"""
+        data = PrescriptionData(patientName="Jean Dupont", dosage="500mg")
+
+        assert data.get_missing_fields() == [
+            "Age/Date de naissance",
+            "Diagnostic",
+            "Medicament",
+            "Duree du traitement",
+            "Instructions speciales",
+        ]
+        assert data.is_complete() is False
+
+    def test_complete_prescription(self):
+        """Test that a fully filled prescription has no missing fields"""
+        data = PrescriptionData(
+            patientName="Jean Dupont", patientAge="45 ans", diagnosis="Angine",
+            medication="Amoxicilline", dosage="500mg 3x/jour", duration="7 jours",
+            specialInstructions="Pendant les repas"
+        )
+
+        assert data.get_missing_fields() == []
+        assert data.is_complete() is True
+
+    def test_format_display(self):
+        """Test that only collected fields are displayed, in order"""
+        data = PrescriptionData(medication="Amoxicilline", patientName="Jean Dupont")
+
+        assert data.format_display() == "- Nom: Jean Dupont\n- Medicament: Amoxicilline"
+        assert PrescriptionData().format_display() == "Aucune info"
+
+
+class TestChatRequest:
+    """Test chat session selection"""
+
+    def test_defaults_to_single_session(self):
+        """Test that clients without session_id keep using one session"""
+        assert ChatRequest(message="bonjour").session_id == DEFAULT_SESSION_ID
+
+    def test_rejects_oversized_session_id(self):
+        """Test that session ids are bounded"""
+        with pytest.raises(ValueError):
+            ChatRequest(message="bonjour", session_id="x" * 65)
+
+
+# ============================================================================
+# REGEX PREFILTER TESTS
+# ============================================================================
+
+class TestPrefillTrivialFields:
+    """Test extraction of unambiguous fields without the LLM"""
+
+    def test_extracts_age_and_name(self):
+        """Test that explicit age and patient markers are picked up"""
+        data = prefill_trivial_fields("Patient: Jean Dupont, 45 ans, angine", PrescriptionData())
+
+        assert data.patientName == "Jean Dupont"
+        assert data.patientAge == "45 ans"
+
+    @pytest.mark.parametrize("text", ["Nom: Jean Dupont", "nom du patient : Jean Dupont"])
+    def test_extracts_name_label(self, text):
+        """Test that an explicit name label is picked up"""
+        data = prefill_trivial_fields(text, PrescriptionData())
+
+        assert data.patientName == "Jean Dupont"
+
+    def test_keeps_existing_values(self):
+        """Test that already collected fields are not overwritten"""
+        data = PrescriptionData(patientName="Marie Curie", patientAge="60 ans")
+        data = prefill_trivial_fields("patiente - Jeanne Martin, 32 ans", data)
+
+        assert data.patientName == "Marie Curie"
+        assert data.patientAge == "60 ans"
+
+    @pytest.mark.parametrize("text", ["âgée de 70 ans", "Âge : 70 ans", "une femme de 70 ans"])
+    def test_extracts_age_in_age_context(self, text):
+        """Test that an age is picked up from an explicit age context"""
+        data = prefill_trivial_fields(text, PrescriptionData())
+
+        assert data.patientAge == "70 ans"
+
+    @pytest.mark.parametrize("text", [
+        "diabétique depuis 10 ans",
+        "patient diabétique depuis 10 ans",
+        "Patient: Jean Dupont, depuis 10 ans",
+        "traitement pendant 2 ans",
+        "45 ans",
+    ])
+    def test_ignores_durations(self, text):
+        """Test that a duration in years is not taken as the age"""
+        data = prefill_trivial_fields(text, PrescriptionData())
+
+        assert data.patientAge is None
+
+    @pytest.mark.parametrize("text", [
+        "Amoxicilline 500mg pendant 7 jours",
+        "le patient tousse depuis 3 semaines",
+    ])
+    def test_ignores_messages_without_markers(self, text):
+        """Test that nothing is extracted when no marker is present"""
+        data = prefill_trivial_fields(text, PrescriptionData())
+
+        assert data.patientName is None
+        assert data.patientAge is None
+
+
+# ============================================================================
+# EMPTY RESPONSE TESTS
+# ============================================================================
+
+class TestIsEmptyResponse:
+    """Test detection of placeholder values returned by the model"""
+
+    @pytest.mark.parametrize("value", [
+        "", "Aucun", "  non spécifié", "N/A", "null", "(pas d'information)",
+    ])
+    def test_placeholders_are_empty(self, value):
+        """Test that placeholder values are treated as missing"""
+        assert is_empty_response(value)
+
+    @pytest.mark.parametrize("value", ["Jean Dupont", "45 ans", "Amoxicilline 500mg"])
+    def test_real_values_are_kept(self, value):
+        """Test that actual field values are not discarded"""
+        assert not is_empty_response(value)
+
+
+class TestParseJsonObject:
+    """Test recovery of the JSON object from model output"""
+
+    def test_plain_json(self):
+        """Test that a bare JSON object is parsed"""
+        assert parse_json_object('{"reply": "ok"}') == {"reply": "ok"}
+
+    def test_json_wrapped_in_prose(self):
+        """Test that text around a nested object is ignored"""
+        text = 'Voici: {"extracted": {"Nom": "Jean"}, "reply": "ok"} Merci.'
+
+        assert parse_json_object(text) == {"extracted": {"Nom": "Jean"}, "reply": "ok"}
+
+    @pytest.mark.parametrize("text", ["", "pas de JSON", '["liste"]', '{"tronque": '])
+    def test_no_object(self, text):
+        """Test that output without a JSON object gives None"""
+        assert parse_json_object(text) is None
+
+
+class TestApplyExtractedField:
+    """Test mapping of extracted labels onto prescription fields"""
+
+    @pytest.mark.parametrize("key,attribute", [
+        ("Nom", "patientName"),
+        ("Médicament", "medication"),
+        ("Posologie", "dosage"),
+        ("Durée", "duration"),
+        ("Instructions", "specialInstructions"),
+    ])
+    def test_maps_label_to_field(self, key, attribute):
+        """Test that accented and synonym labels reach the right field"""
+        data = PrescriptionData()
+        apply_extracted_field(data, key, "valeur")
+
+        assert getattr(data, attribute) == "valeur"
+
+    @pytest.mark.parametrize("key,attribute", [
+        ("Allergies", "discovered_allergies"),
+        ("Condition", "discovered_conditions"),
+    ])
+    def test_maps_label_to_list_field(self, key, attribute):
+        """Test that allergies and conditions are stored as lists"""
+        data = PrescriptionData()
+        apply_extracted_field(data, key, "Pénicilline")
+
+        assert getattr(data, attribute) == ["Pénicilline"]
+
+    def test_ignores_unknown_label(self):
+        """Test that unknown labels leave the data untouched"""
+        data = PrescriptionData()
+        apply_extracted_field(data, "Couleur", "bleu")
+
+        assert data.get_missing_fields() == PrescriptionData().get_missing_fields()
+
+
+class TestApplyLabeledLines:
+    """Test the "Label: value" fast path that skips LLM extraction"""
+
+    def test_fully_labeled_message(self):
+        """Test that a message made only of labeled lines is fully applied"""
+        data = PrescriptionData()
+        text = "Nom: Jean Dupont\nAge: 45 ans\nMédicament: Amoxicilline"
+
+        assert apply_labeled_lines(text, data) is True
+        assert data.patientName == "Jean Dupont"
+        assert data.patientAge == "45 ans"
+        assert data.medication == "Amoxicilline"
+
+    def test_free_text_still_needs_llm(self):
+        """Test that unlabeled lines keep the LLM extraction"""
+        data = PrescriptionData()
+
+        assert apply_labeled_lines("Nom: Jean Dupont\nil tousse depuis hier", data) is False
+        assert data.patientName == "Jean Dupont"
+        assert apply_labeled_lines("Bonjour docteur", PrescriptionData()) is False
+
+
+# ============================================================================
+# RESPONSE GENERATION TESTS
+# ============================================================================
+
+class TestGenerateResponse:
+    """Test replies that are produced without calling Ollama"""
+
+    def test_complete_prescription_gets_fixed_reply(self):
+        """Test that no generation is attempted once all fields are known"""
+        data = PrescriptionData(
+            patientName="Jean Dupont", patientAge="45 ans", diagnosis="Angine",
+            medication="Amoxicilline", dosage="500mg 3x/jour", duration="7 jours",
+            specialInstructions="Pendant les repas"
+        )
+
+        assert asyncio.run(generate_response("merci", data)) == COMPLETE_RESPONSE
+
+    def test_fully_labeled_message_skips_fused_call(self):
+        """Test that a message completing every field is answered without Ollama"""
+        message = (
+            "Nom: Jean Dupont\nAge: 45 ans\nDiagnostic: Angine\nMedicament: Amoxicilline\n"
+            "Posologie: 500mg 3x/jour\nDuree: 7 jours\nInstructions: Pendant les repas"
+        )
+
+        data, reply = asyncio.run(extract_and_respond(message, PrescriptionData()))
+
+        assert data.is_complete()
+        assert reply == COMPLETE_RESPONSE
+
+
+class TestExtractDataFromMessage:
+    """Test messages that are resolved without an extraction call"""
+
+    @pytest.mark.parametrize("message", ["ok", "Oui.", "merci beaucoup !", "D'accord", "  ?  "])
+    def test_acknowledgement_skips_extraction(self, message, monkeypatch):
+        """Test that acknowledgements never reach Ollama"""
+        async def fail(prompt):
+            raise AssertionError("extraction should be skipped")
+        monkeypatch.setattr(llm_utils, "_cached_extraction", fail)
+        data = PrescriptionData(patientName="Jean Dupont")
+
+        result = asyncio.run(extract_data_from_message(message, data))
+
+        assert result.patientName == "Jean Dupont"
+        assert result.diagnosis is None
+
+    def test_correction_on_complete_data_is_extracted(self, monkeypatch):
+        """Test that complete data does not stop later corrections (streaming path)"""
+        async def extraction(prompt):
+            return [("Duree", "10 jours"), ("Allergies", "Pénicilline")]
+        monkeypatch.setattr(llm_utils, "_cached_extraction", extraction)
+
+        result = asyncio.run(extract_data_from_message(
+            "en fait 10 jours, allergique a la penicilline", PrescriptionData(**COMPLETE_DATA)
+        ))
+
+        assert result.duration == "10 jours"
+        assert result.discovered_allergies == ["Pénicilline"]
+
+    def test_short_answer_is_still_extracted(self, monkeypatch):
+        """Test that short factual answers (an age, a drug) still go to extraction"""
+        async def extraction(prompt):
+            return [("Age", "45 ans")]
+        monkeypatch.setattr(llm_utils, "_cached_extraction", extraction)
+
+        result = asyncio.run(extract_data_from_message("45", PrescriptionData()))
+
+        assert result.patientAge == "45 ans"
+
+
+class TestExtractAndRespond:
+    """Test the fused extraction + reply call"""
+
+    def test_correction_on_complete_data_reaches_llm(self, fake_ollama):
+        """Test that a free-text correction is still extracted once the data is complete"""
+        fake_ollama.responses = [
+            fused_output("C'est noté.", Duree="10 jours", Allergies="Pénicilline"),
+        ]
+        data = PrescriptionData(**COMPLETE_DATA)
+
+        data, reply = asyncio.run(
+            extract_and_respond("en fait 10 jours, et il est allergique a la penicilline", data)
+        )
+
+        assert len(fake_ollama.payloads) == 1
+        assert data.duration == "10 jours"
+        assert data.discovered_allergies == ["Pénicilline"]
+        assert reply == "C'est noté."
+
+    def test_applies_fused_json(self, fake_ollama):
+        """Test that a schema-constrained answer fills the data and gives the reply"""
+        fake_ollama.responses = [fused_output("Quel est le dosage ?", Diagnostic="Angine", Medicament="Amoxicilline")]
+
+        data, reply = asyncio.run(extract_and_respond("angine, je prescris de l'amoxicilline", PrescriptionData()))
+
+        payload = fake_ollama.payloads[0]
+        assert payload["format"] == llm_utils.FUSED_OUTPUT_SCHEMA
+        assert payload["system"] is llm_utils.SYSTEM_PROMPT
+        assert "context" not in payload
+        assert data.diagnosis == "Angine"
+        assert data.medication == "Amoxicilline"
+        assert reply == "Quel est le dosage ?"
+
+    def test_malformed_json_falls_back_to_separate_calls(self, fake_ollama):
+        """Test that an unparsable answer falls back to separate extraction + reply calls"""
+        # Extraction and reply run concurrently: give both the same answer
+        fallback = {"response": "Diagnostic: Bronchite"}
+        fake_ollama.responses = [{"response": "{pas du json"}, fallback, fallback]
+
+        data, reply = asyncio.run(extract_and_respond("bronchite aigue depuis hier", PrescriptionData()))
+
+        assert len(fake_ollama.payloads) == 3
+        assert not fake_ollama.probes
+        assert data.diagnosis == "Bronchite"
+        assert reply == "Diagnostic: Bronchite"
+
+
+class TestCachedExtraction:
+    """Test the extraction cache and in-flight dedupe"""
+
+    def test_concurrent_identical_prompts_share_one_call(self, fake_ollama):
+        """Test that identical prompts in flight together hit Ollama once"""
+        fake_ollama.responses = [{"response": "Diagnostic: Otite"}]
+        prompt = "test in-flight dedupe: otite"
+
+        async def run_both():
+            return await asyncio.gather(
+                llm_utils._cached_extraction(prompt), llm_utils._cached_extraction(prompt)
+            )
+
+        first, second = asyncio.run(run_both())
+
+        assert len(fake_ollama.payloads) == 1
+        assert first == second == [("Diagnostic", "Otite")]
+        assert not llm_utils._EXTRACTION_INFLIGHT
+
+
+# ============================================================================
+# SIGNATURE TESTS
+# ============================================================================
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+
+class TestValidateSignatureImage:
+    """Test in-memory validation of base64 signature images"""
+
+    def test_accepts_data_url(self):
+        """Test that a PNG data URL is decoded to its bytes"""
+        png = PNG_HEADER + b"data"
+        signature = "data:image/png;base64," + base64.b64encode(png).decode()
+
+        assert validate_signature_image(signature) == png
+
+    @pytest.mark.parametrize("signature", [
+        "",
+        "pas du base64 !",
+        base64.b64encode(b"GIF89a").decode(),
+    ])
+    def test_rejects_invalid_images(self, signature):
+        """Test that empty, malformed and non-PNG payloads are rejected"""
+        assert validate_signature_image(signature) is None
+
+    def test_rejects_oversized_image(self):
+        """Test that oversized payloads are rejected"""
+        png = PNG_HEADER + bytes(MAX_SIGNATURE_BYTES)
+
+        assert validate_signature_image(base64.b64encode(png).decode()) is None
+
+
+# ============================================================================
+# RESPONSE CACHE TESTS
+# ============================================================================
+
+class TestResponseCacheKey:
+    """Test keys of the generated-response cache"""
+
+    def test_normalizes_case_and_punctuation(self):
+        """Test that trivially different messages share a cache entry"""
+        data = PrescriptionData(patientName="Jean Dupont")
+
+        assert _response_cache_key("Bonjour, docteur !", data) == _response_cache_key("bonjour docteur", data)
+
+    def test_depends_on_collected_data(self):
+        """Test that replies are never shared between different patients"""
+        key1 = _response_cache_key("bonjour", PrescriptionData(patientName="Jean Dupont"))
+        key2 = _response_cache_key("bonjour", PrescriptionData(patientName="Marie Curie"))
+
+        assert key1 != key2
+
+    def test_cached_reply_counts_as_hit(self):
+        """Test that a cached reply is returned without Ollama and counted"""
+        data = PrescriptionData(patientName="Jean Dupont")
+        key = _response_cache_key("bonjour", data)
+        _RESPONSE_CACHE[key] = "Bonjour, quel est l'age du patient ?"
+        hits = get_cache_stats()["response"]["hits"]
+        try:
+            assert asyncio.run(generate_response("Bonjour !", data)) == "Bonjour, quel est l'age du patient ?"
+            assert get_cache_stats()["response"]["hits"] == hits + 1
+        finally:
+            _RESPONSE_CACHE.pop(key, None)
+
+    @pytest.mark.parametrize("done,cached", [(True, True), (False, False)])
+    def test_caches_only_finished_streams(self, monkeypatch, done, cached):
+        """Test that a streamed reply cut off mid-way is not cached"""
+        async def fake_stream(prompt, max_tokens=100, system=None, status=None):
+            yield "Merci, "
+            if done:
+                yield "quel est le diagnostic ?"
+                status["done"] = True
+
+        async def collect():
+            return [chunk async for chunk in stream_response("merci docteur", data)]
+
+        monkeypatch.setattr(llm_utils, "stream_ollama", fake_stream)
+        data = PrescriptionData(patientName="Jean Dupont")
+        key = _response_cache_key("merci docteur", data)
+        _RESPONSE_CACHE.pop(key, None)
+        try:
+            asyncio.run(collect())
+            assert (key in _RESPONSE_CACHE) is cached
+        finally:
+            _RESPONSE_CACHE.pop(key, None)
+
+
+# ============================================================================
+# OLLAMA REQUEST TESTS
+# ============================================================================
+
+class TestOllamaRequest:
+    """Test the /api/generate payload"""
+
+    def test_keeps_requested_budget(self):
+        """Test that a short prompt gets the full decode budget"""
+        _, payload = _ollama_request("Bonjour", "Systeme", stream=False, max_tokens=192)
+
+        assert payload["options"]["num_predict"] == 192
+
+    def test_caps_budget_to_remaining_context(self):
+        """Test that decoding never runs past the context window"""
+        prompt = "x" * 3 * (OLLAMA_NUM_CTX - 100)
+        _, payload = _ollama_request(prompt, None, stream=False, max_tokens=192)
+
+        assert 0 < payload["options"]["num_predict"] < 100
+
+    def test_slots_bound_concurrent_generations(self):
+        """Test that requests beyond OLLAMA_MAX_CONCURRENT wait for a slot"""
+        async def scenario():
+            release = asyncio.Event()
+
+            async def generation():
+                async with _ollama_slot():
+                    await release.wait()
+
+            tasks = [asyncio.create_task(generation()) for _ in range(OLLAMA_MAX_CONCURRENT + 1)]
+            await asyncio.sleep(0)
+            load = get_ollama_load()
+            release.set()
+            await asyncio.gather(*tasks)
+            return load, get_ollama_load()
+
+        during, after = asyncio.run(scenario())
+
+        assert during == {"running": OLLAMA_MAX_CONCURRENT, "waiting": 1}
+        assert after == {"running": 0, "waiting": 0}
@@ -1,14 +1,45 @@
 """Voice and AI utilities for Vocalis"""
 
 import logging
-import json
+import re
 from typing import Dict, List, Tuple, Optional
 from datetime import datetime
 import whisper
-from llm_utils import call_ollama
+from llm_utils import call_ollama, parse_json_object, SYSTEM_PROMPT
 
 logger = logging.getLogger("vocalis-backend")
 
+# JSON Schema enforced by Ollama on parse_prescription_text output
+_PRESCRIPTION_TEXT_KEYS = (
+    "diagnosis", "medication", "dosage", "duration", "special_instructions", "allergies", "patient_name",
+)
+PRESCRIPTION_TEXT_SCHEMA = {
+    "type": "object",
+    "properties": {key: {"type": ["string", "null"]} for key in _PRESCRIPTION_TEXT_KEYS},
+    "required": list(_PRESCRIPTION_TEXT_KEYS),
+}
+
+PRESCRIPTION_TEXT_INSTRUCTIONS = """Extrais les informations suivantes du texte d'ordonnance ci-dessous et retourne UNIQUEMENT du JSON valide (pas de texte supplémentaire).
+
+Retourne EXACTEMENT ce format JSON (remplace par null si non trouvé):
+{
+    "diagnosis": "diagnostic/maladie (ex: bronchite, grippe)",
+    "medication": "nom du médicament",
+    "dosage": "dosage avec unité (ex: 500mg)",
+    "duration": "durée du traitement (ex: 7 jours)",
+    "special_instructions": "fréquence et instructions spéciales (ex: trois fois par jour avec repas)",
+    "allergies": "allergies mentionnées (ex: allergie aux pénicillines)",
+    "patient_name": "nom du patient si mentionné"
+}
+
+Règles importantes:
+1. Le dosage DOIT contenir un nombre valide (pas 00, pas 0)
+2. Accepte les variations: mg, g, ml, mcg, gouttes, etc.
+3. Pour la durée: accepte jours, semaines, mois
+4. Extrait diagnostic et allergies si mentionnés dans le texte
+5. Retourne UNIQUEMENT du JSON, aucun texte avant ou après
+6. Si un champ n'est pas trouvé, utilise null"""
+
 # Load Whisper model (small model, ~461MB)
 WHISPER_MODEL = whisper.load_model("small", device="cpu")
 
@@ -43,6 +74,17 @@ def transcribe_audio(audio_file_path: str, language: str = "fr") -> Tuple[str, f
         raise
 
 
+# Known interacting pairs (simplified), indexed both ways: drug -> the pair it belongs to
+_INTERACTION_PAIRS = (
+    ("warfarin", "aspirin"),
+    ("metformin", "alcohol"),
+    ("lisinopril", "potassium"),
+)
+_INTERACTIONS = {drug: frozenset(pair) for pair in _INTERACTION_PAIRS for drug in pair}
+
+_DOSAGE_NUMBER_RE = re.compile(r'\d+')
+
+
 def validate_medication(
     medication_name: str,
     dosage: str,
@@ -72,8 +114,10 @@ def validate_medication(
     warnings = []
     errors = []
 
+    medication_key = medication_name.lower()
+
     # Check for allergy
-    if medication_name.lower() in [med.lower() for med in patient_allergies]:
+    if any(medication_key == allergy.lower() for allergy in patient_allergies):
         errors.append({
             "type": "allergy_warning",
             "message": f"Patient is allergic to {medication_name}",
@@ -81,7 +125,7 @@ def validate_medication(
         })
 
     # Check age appropriateness (basic validation)
-    if "pediatric" in medication_name.lower() and patient_age > 18:
+    if "pediatric" in medication_key and patient_age > 18:
         warnings.append({
             "type": "age_warning",
             "message": "Pediatric medication for adult patient",
@@ -103,10 +147,9 @@ def validate_medication(
         })
     else:
         # Check for suspicious dosage values (e.g., "00mg", "0mg")
-        import re
-        dosage_num = re.search(r'(\d+)', dosage)
+        dosage_num = _DOSAGE_NUMBER_RE.search(dosage)
         if dosage_num:
-            num_value = int(dosage_num.group(1))
+            num_value = int(dosage_num.group(0))
             if num_value == 0:
                 errors.append({
                     "type": "invalid_value",
@@ -115,21 +158,15 @@ def validate_medication(
                 })
 
     # Check for common interactions (simplified)
-    interaction_pairs = [
-        ("warfarin", "aspirin"),
-        ("metformin", "alcohol"),
-        ("lisinopril", "potassium"),
-    ]
-
-    for med1, med2 in interaction_pairs:
-        if medication_name.lower() == med1 or medication_name.lower() == med2:
-            for current_med in current_medications:
-                if current_med.lower() == med2 or current_med.lower() == med1:
-                    warnings.append({
-                        "type": "interaction_warning",
-                        "message": f"Possible interaction between {medication_name} and {current_med}",
-                        "severity": "high"
-                    })
+    interacting = _INTERACTIONS.get(medication_key)
+    if interacting:
+        for current_med in current_medications:
+            if current_med.lower() in interacting:
+                warnings.append({
+                    "type": "interaction_warning",
+                    "message": f"Possible interaction between {medication_name} and {current_med}",
+                    "severity": "high"
+                })
 
     return {
         "valid": len(errors) == 0,
@@ -155,8 +192,6 @@ async def parse_prescription_text(text: str) -> Dict:
     - duration
     - special_instructions
     """
-    import json
-
     prescription = {
         "patient_name": None,
         "medication": None,
@@ -167,43 +202,20 @@ async def parse_prescription_text(text: str) -> Dict:
         "allergies": None,
     }
 
-    # Create a structured extraction prompt
-    prompt = f"""Tu es un assistant medical spécialisé dans l'extraction d'informations d'ordonnances.
-
-Extrais les informations suivantes du texte ci-dessous et retourne UNIQUEMENT du JSON valide (pas de texte supplémentaire):
-
-Texte de l'ordonnance:
-"{text}"
-
-Retourne EXACTEMENT ce format JSON (remplace par null si non trouvé):
-{{
-    "diagnosis": "diagnostic/maladie (ex: bronchite, grippe)",
-    "medication": "nom du médicament",
-    "dosage": "dosage avec unité (ex: 500mg)",
-    "duration": "durée du traitement (ex: 7 jours)",
-    "special_instructions": "fréquence et instructions spéciales (ex: trois fois par jour avec repas)",
-    "allergies": "allergies mentionnées (ex: allergie aux pénicillines)",
-    "patient_name": "nom du patient si mentionné"
-}}
-
-Règles importantes:
-1. Le dosage DOIT contenir un nombre valide (pas 00, pas 0)
-2. Accepte les variations: mg, g, ml, mcg, gouttes, etc.
-3. Pour la durée: accepte jours, semaines, mois
-4. Extrait diagnostic et allergies si mentionnés dans le texte
-5. Retourne UNIQUEMENT du JSON, aucun texte avant ou après
-6. Si un champ n'est pas trouvé, utilise null"""
+    # Static instructions first, the transcript last: the cached prefix covers
+    # SYSTEM_PROMPT and the instructions, only the text is prefilled per call
+    prompt = f'{PRESCRIPTION_TEXT_INSTRUCTIONS}\n\nTexte de l\'ordonnance:\n"{text}"'
 
     try:
-        response = await call_ollama(prompt, max_tokens=200)
-
-        # Try to extract JSON from response
-        json_start = response.find('{')
-        json_end = response.rfind('}') + 1
+        response = await call_ollama(
+            prompt, max_tokens=160, system=SYSTEM_PROMPT,
+            json_schema=PRESCRIPTION_TEXT_SCHEMA, deterministic=True
+        )
 
-        if json_start >= 0 and json_end > json_start:
-            json_str = response[json_start:json_end]
-            parsed_json = json.loads(json_str)
+        # The schema should make the whole response a single JSON object;
+        # parse_json_object also copes with servers that ignore it
+        parsed_json = parse_json_object(response) if response else None
+        if parsed_json:
 
             # Map JSON response to prescription dict
             prescription["medication"] = parsed_json.get("medication")
@@ -214,12 +226,14 @@ Règles importantes:
             prescription["diagnosis"] = parsed_json.get("diagnosis")
             prescription["allergies"] = parsed_json.get("allergies")
 
-            logger.info(f"LLM parsed prescription: medication={prescription['medication']}, dosage={prescription['dosage']}, diagnosis={prescription['diagnosis']}, allergies={prescription['allergies']}")
+            logger.info(
+                "LLM parsed prescription: medication=%s, dosage=%s, diagnosis=%s, allergies=%s",
+                prescription["medication"], prescription["dosage"],
+                prescription["diagnosis"], prescription["allergies"]
+            )
         else:
-            logger.warning(f"Failed to extract JSON from LLM response: {response}")
+            logger.warning("No JSON object in LLM response, no prescription data extracted")
 
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON decode error from LLM response: {e}")
     except Exception as e:
         logger.error(f"Error calling LLM for prescription parsing: {e}")
 